@@ -6,23 +6,138 @@ Character Consistency Agent
 Responsible for ensuring character consistency during comic generation, including feature extraction, matching algorithms, and consistency guarantees
 """
 
+import asyncio
 import logging
 import json
-from typing import Dict, Any, List
+from collections import Counter
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Tuple, Awaitable, TypeVar
 from datetime import datetime
+import hashlib
+import math
 import re
 
-from services.ai_service import AIService
+import orjson
+
+from services.ai_service import get_shared_ai_service
 from services.character_consistency import (
     CharacterConsistencyManager, CharacterProfile
 )
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# 并发AI调用上限，避免触发AI服务的速率限制
+_MAX_CONCURRENT_AI_CALLS = 4
+
+# 各类AI调用的输出token上限（返回的JSON通常不足1KB，过大的预算只会拖慢生成）
+_FEATURE_MAX_TOKENS = 1024
+_PERFORMANCE_MAX_TOKENS = 1024
+_CORRECTION_MAX_TOKENS = 1500
+_BATCH_MAX_TOKENS = 8000
+
+# 角色档案外貌特征中覆盖这些字段时，可直接构建角色特征而无需调用AI
+_REQUIRED_VISUAL_FEATURES = ('face', 'hair', 'body_type', 'clothing')
+
+# 角色特征缓存的最大条目数
+_FEATURE_CACHE_MAX_SIZE = 256
+
+# 一致性问题严重程度对应的扣分
+_SEVERITY_PENALTIES = {
+    'critical': 0.3,
+    'high': 0.2,
+    'medium': 0.1,
+    'low': 0.05
+}
+
+
+def _aggregate_scores(
+    scores: List[float],
+    severities: Iterable[str] = (),
+    default_average: float = 0.0
+) -> Tuple[float, float]:
+    """
+    汇总一致性评分，返回 (平均分数, 严重程度扣分合计)
+
+    累加由 math.fsum 在C层完成；无分数时平均分数取 default_average，未知严重程度不扣分。
+    """
+    average = math.fsum(scores) / len(scores) if scores else default_average
+    penalty = math.fsum(_SEVERITY_PENALTIES.get(severity, 0.0) for severity in severities)
+    return average, penalty
+
+
+def _extract_json_object(text: str) -> Optional[str]:
+    """截取文本中第一个括号平衡的 {...} 片段（忽略字符串内的括号）"""
+    start = text.find('{')
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+
+def _loads_ai_json(text: str) -> Any:
+    """
+    解析AI返回的JSON
+
+    先整体解析；失败时（如模型在JSON前后附加说明文字或代码块标记）
+    截取第一个完整的JSON对象再解析，仍失败则抛出原始的解析异常。
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as error:
+        json_object = _extract_json_object(text)
+        if json_object is None:
+            raise
+        try:
+            return orjson.loads(json_object)
+        except orjson.JSONDecodeError:
+            raise error from None
+
+
+def _json_dumps(data: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """使用orjson序列化为字符串（输出UTF-8原文，等价于 json.dumps(..., ensure_ascii=False)）"""
+    option = orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(data, option=option).decode()
+
+
+# 常见姓氏 + 1~2个汉字的人名模式（模块加载时编译一次，姓氏字符集由sre编译为位图查找）
+_SURNAME_NAME_RE = re.compile(
+    r'([王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾萧田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤][一-龯]{1,2})'
+)
+
 
 class CharacterFeature:
     """角色特征数据结构"""
 
+    __slots__ = (
+        'character_name', 'visual_features', 'personality_features',
+        'style_features', 'consistency_tags', 'confidence', 'extraction_time'
+    )
+
     def __init__(
         self,
         character_name: str,
@@ -38,10 +153,13 @@ class CharacterFeature:
         self.style_features = style_features
         self.consistency_tags = consistency_tags
         self.confidence = confidence
-        self.extraction_time = datetime.now().isoformat()
+        # 提取时间在首次序列化时才生成
+        self.extraction_time: Optional[str] = None
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
+        if self.extraction_time is None:
+            self.extraction_time = datetime.now().isoformat()
         return {
             'character_name': self.character_name,
             'visual_features': self.visual_features,
@@ -56,60 +174,85 @@ class CharacterFeature:
 class ConsistencyRule:
     """一致性规则数据结构"""
 
+    __slots__ = ('rule_name', 'rule_type', 'condition', 'action', 'priority', 'created_time')
+
     def __init__(
         self,
         rule_name: str,
         rule_type: str,  # visual, personality, style
         condition: str,
         action: str,
-        priority: int = 1
+        priority: int = 1,
+        created_time: Optional[str] = None
     ):
         self.rule_name = rule_name
         self.rule_type = rule_type
         self.condition = condition
         self.action = action
         self.priority = priority
-        self.created_time = datetime.now().isoformat()
+        self.created_time = created_time
+
+
+class ImageConsistencyResult(NamedTuple):
+    """单张图像的一致性检查结果（常用字段展开，避免重复的嵌套字典查找）"""
+    image_info: Dict[str, Any]
+    consistency_match: Dict[str, Any]
+    match_score: float
+    mismatched_features: List[str]
+    suggestions: List[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            'image_info': self.image_info,
+            'consistency_match': self.consistency_match
+        }
 
 
 class CharacterConsistencyAgent:
     """角色一致性Agent"""
 
+    # 默认一致性规则
+    DEFAULT_RULES: Tuple[ConsistencyRule, ...] = (
+        ConsistencyRule(
+            "maintain_hair_color",
+            "visual",
+            "character.has_hair_color",
+            "keep_hair_color_consistent",
+            priority=3
+        ),
+        ConsistencyRule(
+            "maintain_clothing_style",
+            "visual",
+            "character.has_clothing_preference",
+            "keep_clothing_style_consistent",
+            priority=2
+        ),
+        ConsistencyRule(
+            "maintain_personality",
+            "personality",
+            "character.has_personality_traits",
+            "express_personality_consistently",
+            priority=2
+        ),
+        ConsistencyRule(
+            "maintain_age_appearance",
+            "visual",
+            "character.has_age_range",
+            "keep_age_appropriate_appearance",
+            priority=2
+        )
+    )
+
     def __init__(self):
-        self.ai_service = AIService()
+        self.ai_service = get_shared_ai_service()
         self.consistency_manager = CharacterConsistencyManager()
 
-        # 默认一致性规则
-        self.default_rules = [
-            ConsistencyRule(
-                "maintain_hair_color",
-                "visual",
-                "character.has_hair_color",
-                "keep_hair_color_consistent",
-                priority=3
-            ),
-            ConsistencyRule(
-                "maintain_clothing_style",
-                "visual",
-                "character.has_clothing_preference",
-                "keep_clothing_style_consistent",
-                priority=2
-            ),
-            ConsistencyRule(
-                "maintain_personality",
-                "personality",
-                "character.has_personality_traits",
-                "express_personality_consistently",
-                priority=2
-            ),
-            ConsistencyRule(
-                "maintain_age_appearance",
-                "visual",
-                "character.has_age_range",
-                "keep_age_appropriate_appearance",
-                priority=2
-            )
-        ]
+        # 角色特征缓存：角色档案内容哈希 -> AI提取的角色特征
+        self._feature_cache: Dict[str, CharacterFeature] = {}
+
+        # 默认一致性规则（类级共享，不随实例重建）
+        self.default_rules = self.DEFAULT_RULES
 
     async def ensure_character_consistency(
         self,
@@ -143,29 +286,54 @@ class CharacterConsistencyAgent:
             # 2. 从脚本中提取角色出现信息
             script_characters = await self._extract_characters_from_script(script_content)
 
-            # 3. 为每个角色进行一致性检查
-            consistency_results = {}
+            semaphore = asyncio.Semaphore(_MAX_CONCURRENT_AI_CALLS)
+            characters_to_check = [
+                character for character in character_profiles
+                if character.name in script_characters
+            ]
+
+            # 3. 批量提取所有角色的特征和表现要求（每类只需一次AI调用）
+            features_by_name, requirements_by_name = await asyncio.gather(
+                self._run_limited(semaphore, self._extract_all_character_features_batch(characters_to_check)),
+                self._run_limited(semaphore, self._analyze_all_performance_requirements_batch(
+                    characters_to_check, script_characters
+                ))
+            )
 
-            for character in character_profiles:
-                if character.name in script_characters:
-                    character_result = await self._check_single_character_consistency(
-                        character, script_characters[character.name], generated_images, project_path
-                    )
-                    consistency_results[character.name] = character_result
+            # 4. 一次性提取图像文本并单次扫描，建立角色 -> 出现该角色的图像索引映射
+            character_to_images = self._map_characters_to_images(
+                self._extract_image_texts(generated_images),
+                [character.name for character in characters_to_check]
+            )
 
-            # 4. 应用一致性修正
+            # 5. 并发为每个角色进行一致性检查
+            character_results = await asyncio.gather(*[
+                self._check_single_character_consistency(
+                    character, script_characters[character.name], generated_images, project_path, semaphore,
+                    character_features=features_by_name.get(character.name),
+                    performance_requirements=requirements_by_name.get(character.name),
+                    relevant_image_indices=character_to_images.get(character.name, [])
+                )
+                for character in characters_to_check
+            ])
+            consistency_results = {
+                character.name: character_result
+                for character, character_result in zip(characters_to_check, character_results)
+            }
+
+            # 6. 应用一致性修正
             correction_results = {}
             if apply_corrections:
                 correction_results = await self._apply_consistency_corrections(
-                    consistency_results, project_path
+                    consistency_results, project_path, semaphore
                 )
 
-            # 5. 生成一致性报告
+            # 7. 生成一致性报告
             consistency_report = self._generate_consistency_report(
                 consistency_results, correction_results
             )
 
-            logger.info(f"角色一致性检查完成，检查了 {len(consistency_results)} 个角色")
+            logger.info("角色一致性检查完成，检查了 %s 个角色", len(consistency_results))
             return {
                 'status': 'completed',
                 'characters_checked': len(consistency_results),
@@ -176,7 +344,7 @@ class CharacterConsistencyAgent:
             }
 
         except Exception as e:
-            logger.error(f"角色一致性检查失败: {e}")
+            logger.error("角色一致性检查失败: %s", e)
             return {'status': 'error', 'error': str(e)}
 
     async def _extract_characters_from_script(self, script_content: str) -> Dict[str, Dict[str, Any]]:
@@ -201,22 +369,22 @@ class CharacterConsistencyAgent:
 
 请以JSON格式返回：
 {{
-    "characters": {
-        "角色名": {
+    "characters": {{
+        "角色名": {{
             "appearances": [
-                {
+                {{
                     "scene_number": 1,
                     "scene_description": "场景描述",
                     "character_action": "角色动作",
                     "character_expression": "表情描述",
                     "clothing_description": "服装描述",
                     "interaction_with": ["其他角色名"]
-                }
+                }}
             ],
             "total_appearances": 3,
             "key_scenes": [1, 3]
-        }
-    }
+        }}
+    }}
 }}
 """
 
@@ -230,66 +398,88 @@ class CharacterConsistencyAgent:
 
             # 解析结果
             try:
-                ai_data = json.loads(result)
+                ai_data = _loads_ai_json(result)
                 return ai_data.get('characters', {})
             except json.JSONDecodeError:
                 logger.warning("脚本角色提取结果解析失败")
                 return self._basic_script_character_extraction(script_content)
 
         except Exception as e:
-            logger.error(f"脚本角色提取失败: {e}")
+            logger.error("脚本角色提取失败: %s", e)
             return self._basic_script_character_extraction(script_content)
 
     def _basic_script_character_extraction(self, script_content: str) -> Dict[str, Dict[str, Any]]:
         """基础脚本角色提取"""
-        characters = {}
-
-        # 简单的人名识别
-        name_pattern = r'([王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾萧田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤][一-龯]{1,2})'
-
-        matches = re.finditer(name_pattern, script_content)
-        for match in matches:
-            name = match.group()
-            if name not in characters:
-                characters[name] = {
-                    'appearances': [],
-                    'total_appearances': 0,
-                    'key_scenes': []
-                }
-            characters[name]['total_appearances'] += 1
+        # 简单的人名识别：findall + Counter 在C层完成扫描和计数
+        name_counts = Counter(_SURNAME_NAME_RE.findall(script_content))
 
-        return characters
+        return {
+            name: {
+                'appearances': [],
+                'total_appearances': count,
+                'key_scenes': []
+            }
+            for name, count in name_counts.items()
+        }
 
     async def _check_single_character_consistency(
         self,
         character_profile: CharacterProfile,
         script_info: Dict[str, Any],
         generated_images: List[Dict[str, Any]],
-        project_path: str
+        project_path: str,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        character_features: Optional[CharacterFeature] = None,
+        performance_requirements: Optional[Dict[str, Any]] = None,
+        relevant_image_indices: Optional[List[int]] = None
     ) -> Dict[str, Any]:
-        """检查单个角色的一致性"""
-        logger.info(f"检查角色 {character_profile.name} 的一致性...")
-
-        try:
-            # 1. 提取角色特征
-            character_features = await self._extract_character_features(character_profile)
+        """
+        检查单个角色的一致性
 
-            # 2. 分析脚本中的角色表现要求
-            performance_requirements = await self._analyze_performance_requirements(
-                character_profile, script_info
-            )
+        character_features / performance_requirements 为批量预先计算的结果，
+        缺失时才单独调用AI服务；relevant_image_indices 为出现该角色的图像索引。
+        """
+        logger.info("检查角色 %s 的一致性...", character_profile.name)
+        semaphore = semaphore or asyncio.Semaphore(_MAX_CONCURRENT_AI_CALLS)
 
-            # 3. 检查已生成图像的一致性
+        try:
+            # 1. 提取角色特征  2. 分析脚本中的角色表现要求（仅对缺失项调用AI，并发执行）
+            fallback_calls = {}
+            if character_features is None:
+                fallback_calls['features'] = self._extract_character_features(character_profile)
+            if performance_requirements is None:
+                fallback_calls['requirements'] = self._analyze_performance_requirements(
+                    character_profile, script_info
+                )
+            if fallback_calls:
+                fallback_results = dict(zip(fallback_calls, await asyncio.gather(*[
+                    self._run_limited(semaphore, call) for call in fallback_calls.values()
+                ])))
+                character_features = fallback_results.get('features', character_features)
+                performance_requirements = fallback_results.get('requirements', performance_requirements)
+
+            # 3. 并发检查已生成图像的一致性
+            if relevant_image_indices is None:
+                relevant_image_indices = self._map_characters_to_images(
+                    self._extract_image_texts(generated_images), [character_profile.name]
+                ).get(character_profile.name, [])
+            images_with_character = [generated_images[index] for index in relevant_image_indices]
+            consistency_matches = await asyncio.gather(*[
+                self._run_limited(semaphore, self.consistency_manager.check_character_consistency(
+                    project_path, character_profile.name, image_info.get('local_path', '')
+                ))
+                for image_info in images_with_character
+            ])
             image_consistency_results = []
-            for image_info in generated_images:
-                if self._image_contains_character(image_info, character_profile.name):
-                    consistency_result = await self.consistency_manager.check_character_consistency(
-                        project_path, character_profile.name, image_info.get('local_path', '')
-                    )
-                    image_consistency_results.append({
-                        'image_info': image_info,
-                        'consistency_match': consistency_result.to_dict()
-                    })
+            for image_info, consistency_match in zip(images_with_character, consistency_matches):
+                consistency_match_data = consistency_match.to_dict()
+                image_consistency_results.append(ImageConsistencyResult(
+                    image_info=image_info,
+                    consistency_match=consistency_match_data,
+                    match_score=consistency_match.match_score,
+                    mismatched_features=consistency_match.mismatched_features,
+                    suggestions=consistency_match_data.get('suggestions', [])
+                ))
 
             # 4. 识别一致性问题
             consistency_issues = self._identify_consistency_issues(
@@ -305,14 +495,14 @@ class CharacterConsistencyAgent:
                 'character_name': character_profile.name,
                 'character_features': character_features.to_dict(),
                 'performance_requirements': performance_requirements,
-                'image_consistency_results': image_consistency_results,
+                'image_consistency_results': [result.to_dict() for result in image_consistency_results],
                 'consistency_issues': consistency_issues,
                 'consistency_score': consistency_score,
                 'needs_correction': len(consistency_issues) > 0 or consistency_score < 0.7
             }
 
         except Exception as e:
-            logger.error(f"角色 {character_profile.name} 一致性检查失败: {e}")
+            logger.error("角色 %s 一致性检查失败: %s", character_profile.name, e)
             return {
                 'character_name': character_profile.name,
                 'status': 'error',
@@ -323,6 +513,17 @@ class CharacterConsistencyAgent:
 
     async def _extract_character_features(self, character_profile: CharacterProfile) -> CharacterFeature:
         """提取角色特征"""
+        profile_feature = self._create_profile_character_feature(character_profile)
+        if profile_feature is not None:
+            return profile_feature
+
+        # 外貌特征只序列化一次，同时用于缓存键和提示词
+        appearance_json = _json_dumps(character_profile.appearance_features, sort_keys=True)
+        cache_key = self._feature_cache_key(character_profile, appearance_json)
+        cached_feature = self._feature_cache.get(cache_key)
+        if cached_feature is not None:
+            return cached_feature
+
         try:
             # 构建特征提取提示词
             feature_prompt = f"""
@@ -331,7 +532,7 @@ class CharacterConsistencyAgent:
 角色姓名：{character_profile.name}
 角色描述：{character_profile.description}
 性格特征：{', '.join(character_profile.personality_traits)}
-外貌特征：{json.dumps(character_profile.appearance_features, ensure_ascii=False)}
+外貌特征：{appearance_json}
 
 请提取以下特征：
 
@@ -375,31 +576,176 @@ class CharacterConsistencyAgent:
             result = await self.ai_service.generate_text(
                 prompt=feature_prompt,
                 model_preference="seedream",
-                max_tokens=8000,
+                max_tokens=_FEATURE_MAX_TOKENS,
+                enforce_max_tokens=True,
                 temperature=0.2
             )
 
             # 解析结果
             try:
-                ai_data = json.loads(result)
-
-                return CharacterFeature(
-                    character_name=character_profile.name,
-                    visual_features=ai_data.get('visual_features', {}),
-                    personality_features=ai_data.get('personality_features', []),
-                    style_features=ai_data.get('style_features', {}),
-                    consistency_tags=ai_data.get('consistency_tags', []),
-                    confidence=ai_data.get('confidence', 0.5)
-                )
+                ai_data = _loads_ai_json(result)
+                character_feature = self._build_character_feature(character_profile.name, ai_data)
+                self._cache_character_feature(cache_key, character_feature)
+                return character_feature
 
             except json.JSONDecodeError:
-                logger.warning(f"角色 {character_profile.name} 特征提取结果解析失败")
+                logger.warning("角色 %s 特征提取结果解析失败", character_profile.name)
                 return self._create_basic_character_feature(character_profile)
 
         except Exception as e:
-            logger.error(f"角色 {character_profile.name} 特征提取失败: {e}")
+            logger.error("角色 %s 特征提取失败: %s", character_profile.name, e)
             return self._create_basic_character_feature(character_profile)
 
+    async def _extract_all_character_features_batch(
+        self,
+        character_profiles: List[CharacterProfile]
+    ) -> Dict[str, CharacterFeature]:
+        """批量提取所有角色特征（单次AI调用，档案已完整或已缓存的角色不再提取），缺失的角色由调用方逐个回退"""
+        character_features = {}
+        uncached_profiles = []
+        cache_keys = {}
+        appearance_jsons = {}
+        for profile in character_profiles:
+            profile_feature = self._create_profile_character_feature(profile)
+            if profile_feature is not None:
+                character_features[profile.name] = profile_feature
+                continue
+
+            # 外貌特征只序列化一次，同时用于缓存键和提示词
+            appearance_json = _json_dumps(profile.appearance_features, sort_keys=True)
+            cache_key = self._feature_cache_key(profile, appearance_json)
+            cached_feature = self._feature_cache.get(cache_key)
+            if cached_feature is not None:
+                character_features[profile.name] = cached_feature
+            else:
+                uncached_profiles.append(profile)
+                cache_keys[profile.name] = cache_key
+                appearance_jsons[profile.name] = appearance_json
+
+        if not uncached_profiles:
+            return character_features
+
+        try:
+            profiles_text = "\n\n".join(
+                f"""角色姓名：{profile.name}
+角色描述：{profile.description}
+性格特征：{', '.join(profile.personality_traits)}
+外貌特征：{appearance_jsons[profile.name]}"""
+                for profile in uncached_profiles
+            )
+
+            # 构建批量特征提取提示词
+            feature_prompt = f"""
+请基于以下角色档案，分别为每个角色提取详细的特征信息，用于图像生成的一致性检查：
+
+{profiles_text}
+
+对每个角色提取：
+1. 视觉特征：面部、发型、体型、服装
+2. 性格特征：主要性格特点、情感表达方式、行为习惯
+3. 风格特征：整体艺术风格要求、色彩偏好、表现手法
+
+请以JSON格式返回，features 的键为角色姓名：
+{{
+    "features": {{
+        "角色姓名": {{
+            "visual_features": {{
+                "face": "面部特征描述",
+                "hair": "发型特征描述",
+                "body_type": "体型特征描述",
+                "clothing": "服装特征描述",
+                "key_visual_elements": ["关键视觉元素"]
+            }},
+            "personality_features": ["性格特征列表"],
+            "style_features": {{
+                "art_style": "艺术风格",
+                "color_preference": "色彩偏好",
+                "expression_style": "表现风格"
+            }},
+            "consistency_tags": ["一致性标签"],
+            "confidence": 0.85
+        }}
+    }}
+}}
+"""
+
+            # 调用AI服务
+            result = await self.ai_service.generate_text(
+                prompt=feature_prompt,
+                model_preference="seedream",
+                max_tokens=min(_FEATURE_MAX_TOKENS * len(uncached_profiles), _BATCH_MAX_TOKENS),
+                enforce_max_tokens=True,
+                temperature=0.2
+            )
+
+            # 解析结果
+            try:
+                features_data = _loads_ai_json(result).get('features', {})
+            except (json.JSONDecodeError, AttributeError):
+                logger.warning("批量角色特征提取结果解析失败")
+                return character_features
+
+            for profile in uncached_profiles:
+                feature_data = features_data.get(profile.name)
+                if isinstance(feature_data, dict):
+                    character_feature = self._build_character_feature(profile.name, feature_data)
+                    self._cache_character_feature(cache_keys[profile.name], character_feature)
+                    character_features[profile.name] = character_feature
+
+            return character_features
+
+        except Exception as e:
+            logger.error("批量角色特征提取失败: %s", e)
+            return character_features
+
+    def _feature_cache_key(
+        self,
+        character_profile: CharacterProfile,
+        appearance_json: Optional[str] = None
+    ) -> str:
+        """根据参与特征提取的角色档案字段计算缓存键（appearance_json 为已按键排序序列化的外貌特征）"""
+        if appearance_json is None:
+            appearance_json = _json_dumps(character_profile.appearance_features, sort_keys=True)
+        profile_data = _json_dumps([
+            character_profile.name,
+            character_profile.description,
+            character_profile.personality_traits,
+            appearance_json
+        ])
+        return hashlib.blake2b(profile_data.encode(), digest_size=16).hexdigest()
+
+    def _cache_character_feature(self, cache_key: str, character_feature: CharacterFeature):
+        """缓存AI提取的角色特征，超出容量时淘汰最早加入的条目"""
+        if cache_key not in self._feature_cache and len(self._feature_cache) >= _FEATURE_CACHE_MAX_SIZE:
+            self._feature_cache.pop(next(iter(self._feature_cache)))
+        self._feature_cache[cache_key] = character_feature
+
+    def _build_character_feature(self, character_name: str, ai_data: Dict[str, Any]) -> CharacterFeature:
+        """从AI返回的数据构建角色特征"""
+        return CharacterFeature(
+            character_name=character_name,
+            visual_features=ai_data.get('visual_features', {}),
+            personality_features=ai_data.get('personality_features', []),
+            style_features=ai_data.get('style_features', {}),
+            consistency_tags=ai_data.get('consistency_tags', []),
+            confidence=ai_data.get('confidence', 0.5)
+        )
+
+    def _create_profile_character_feature(self, character_profile: CharacterProfile) -> Optional[CharacterFeature]:
+        """角色档案的外貌特征已覆盖所需的视觉字段时，直接由档案构建角色特征，否则返回None"""
+        appearance_features = character_profile.appearance_features or {}
+        if not all(appearance_features.get(key) for key in _REQUIRED_VISUAL_FEATURES):
+            return None
+
+        return CharacterFeature(
+            character_name=character_profile.name,
+            visual_features=dict(appearance_features),
+            personality_features=character_profile.personality_traits or [],
+            style_features={'art_style': 'default'},
+            consistency_tags=character_profile.consistency_tags or ['profile'],
+            confidence=0.9
+        )
+
     def _create_basic_character_feature(self, character_profile: CharacterProfile) -> CharacterFeature:
         """创建基础角色特征"""
         visual_features = character_profile.appearance_features or {}
@@ -429,7 +775,7 @@ class CharacterConsistencyAgent:
 角色描述：{character_profile.description}
 
 脚本中的出现信息：
-{json.dumps(script_info, ensure_ascii=False)}
+{_json_dumps(script_info)}
 
 请分析：
 1. 角色在不同场景中的表现要求
@@ -457,57 +803,158 @@ class CharacterConsistencyAgent:
             result = await self.ai_service.generate_text(
                 prompt=performance_prompt,
                 model_preference="seedream",
-                max_tokens=8000,
+                max_tokens=_PERFORMANCE_MAX_TOKENS,
+                enforce_max_tokens=True,
                 temperature=0.2
             )
 
             # 解析结果
             try:
-                ai_data = json.loads(result)
+                ai_data = _loads_ai_json(result)
                 return ai_data
             except json.JSONDecodeError:
-                logger.warning(f"角色 {character_profile.name} 表现要求分析结果解析失败")
+                logger.warning("角色 %s 表现要求分析结果解析失败", character_profile.name)
                 return {'performance_requirements': {}, 'consistency_challenges': []}
 
         except Exception as e:
-            logger.error(f"角色 {character_profile.name} 表现要求分析失败: {e}")
+            logger.error("角色 %s 表现要求分析失败: %s", character_profile.name, e)
             return {'performance_requirements': {}, 'consistency_challenges': []}
 
-    def _image_contains_character(
+    async def _analyze_all_performance_requirements_batch(
         self,
-        image_info: Dict[str, Any],
-        character_name: str
-    ) -> bool:
-        """检查图像是否包含指定角色"""
+        character_profiles: List[CharacterProfile],
+        script_characters: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """批量分析所有角色的表现要求（单次AI调用），解析失败时返回空字典，由调用方逐个回退"""
+        if not character_profiles:
+            return {}
+
+        try:
+            characters_text = "\n\n".join(
+                f"""角色姓名：{profile.name}
+角色描述：{profile.description}
+脚本中的出现信息：{_json_dumps(script_characters.get(profile.name, {}))}"""
+                for profile in character_profiles
+            )
+
+            # 构建批量表现要求分析提示词
+            performance_prompt = f"""
+请分别分析以下每个角色在漫画脚本中的表现要求：
+
+{characters_text}
+
+对每个角色分析：
+1. 角色在不同场景中的表现要求
+2. 表情和动作的具体要求
+3. 服装和造型的变化需求
+4. 与其他角色的互动要求
+
+请以JSON格式返回，requirements 的键为角色姓名：
+{{
+    "requirements": {{
+        "角色姓名": {{
+            "performance_requirements": {{
+                "emotional_range": ["情感表现范围"],
+                "action_requirements": ["动作要求"],
+                "clothing_changes": ["服装变化需求"],
+                "interaction_requirements": ["互动要求"]
+            }},
+            "scene_specific_requirements": {{
+                "scene_1": "场景1的特定要求"
+            }},
+            "consistency_challenges": ["一致性挑战点"]
+        }}
+    }}
+}}
+"""
+
+            # 调用AI服务
+            result = await self.ai_service.generate_text(
+                prompt=performance_prompt,
+                model_preference="seedream",
+                max_tokens=min(_PERFORMANCE_MAX_TOKENS * len(character_profiles), _BATCH_MAX_TOKENS),
+                enforce_max_tokens=True,
+                temperature=0.2
+            )
+
+            # 解析结果
+            try:
+                requirements_data = _loads_ai_json(result).get('requirements', {})
+            except (json.JSONDecodeError, AttributeError):
+                logger.warning("批量角色表现要求分析结果解析失败")
+                return {}
+
+            return {
+                profile.name: requirements_data[profile.name]
+                for profile in character_profiles
+                if isinstance(requirements_data.get(profile.name), dict)
+            }
+
+        except Exception as e:
+            logger.error("批量角色表现要求分析失败: %s", e)
+            return {}
+
+    def _extract_image_texts(
+        self,
+        generated_images: List[Dict[str, Any]]
+    ) -> Tuple[List[str], List[str], List[str]]:
+        """一次性把图像信息中的文本提取为三个平行列表：场景描述、对话、旁白"""
+        scenes = [image_info.get('scene_description') or '' for image_info in generated_images]
+        dialogues = [image_info.get('dialogue') or '' for image_info in generated_images]
+        narrations = [image_info.get('narration') or '' for image_info in generated_images]
+        return scenes, dialogues, narrations
+
+    def _map_characters_to_images(
+        self,
+        image_texts: Tuple[List[str], List[str], List[str]],
+        character_names: List[str]
+    ) -> Dict[str, List[int]]:
+        """检查每张图像包含哪些角色，返回角色名 -> 图像索引列表（所有角色名合并为一个模式，逐列扫描图像文本）"""
+        names = sorted({name for name in character_names if name}, key=len, reverse=True)
+        character_to_images = {name: [] for name in names}
+        if not names:
+            return character_to_images
+
+        # 零宽前瞻使每个位置都参与匹配；长名优先，同一位置命中最长的角色名
+        name_pattern = re.compile('(?=(%s))' % '|'.join(map(re.escape, names)))
+        # 命中长名意味着其包含的短名也出现（如“李明华”包含“李明”）
+        contained_names = {name: {other for other in names if other in name} for name in names}
+
         # 简单检查：查看图像信息中是否包含角色名
-        scene_description = image_info.get('scene_description', '')
-        dialogue = image_info.get('dialogue', '')
-        narration = image_info.get('narration', '')
+        image_hits = [set() for _ in image_texts[0]]
+        for column in image_texts:
+            for hits, text in zip(image_hits, column):
+                if text:
+                    for matched_name in set(name_pattern.findall(text)):
+                        hits |= contained_names[matched_name]
 
-        return character_name in scene_description or character_name in dialogue or character_name in narration
+        for image_index, hits in enumerate(image_hits):
+            for name in hits:
+                character_to_images[name].append(image_index)
+
+        return character_to_images
 
     def _identify_consistency_issues(
         self,
         character_features: CharacterFeature,
         performance_requirements: Dict[str, Any],
-        image_consistency_results: List[Dict[str, Any]]
+        image_consistency_results: List[ImageConsistencyResult]
     ) -> List[Dict[str, Any]]:
         """识别一致性问题"""
         issues = []
 
         # 检查图像一致性结果
         for result in image_consistency_results:
-            consistency_match = result.get('consistency_match', {})
-            match_score = consistency_match.get('match_score', 1.0)
+            match_score = result.match_score
 
             if match_score < 0.7:
                 issues.append({
                     'issue_type': 'image_consistency',
                     'severity': 'high' if match_score < 0.5 else 'medium',
                     'description': f"图像一致性分数过低: {match_score:.2f}",
-                    'affected_image': result.get('image_info', {}),
-                    'mismatched_features': consistency_match.get('mismatched_features', []),
-                    'suggestions': consistency_match.get('suggestions', [])
+                    'affected_image': result.image_info,
+                    'mismatched_features': result.mismatched_features,
+                    'suggestions': result.suggestions
                 })
 
         # 检查特征置信度
@@ -536,33 +983,20 @@ class CharacterConsistencyAgent:
     def _calculate_character_consistency_score(
         self,
         character_features: CharacterFeature,
-        image_consistency_results: List[Dict[str, Any]],
+        image_consistency_results: List[ImageConsistencyResult],
         consistency_issues: List[Dict[str, Any]]
     ) -> float:
         """计算角色一致性分数"""
         # 基础分数
         base_score = character_features.confidence * 0.3
 
-        # 图像一致性分数
-        if image_consistency_results:
-            image_scores = [result.get('consistency_match', {}).get('match_score', 0.0) for result in image_consistency_results]
-            avg_image_score = sum(image_scores) / len(image_scores)
-            image_score = avg_image_score * 0.5
-        else:
-            image_score = 0.8 * 0.5  # 默认分数
-
-        # 问题扣分
-        penalty = 0.0
-        for issue in consistency_issues:
-            severity = issue.get('severity', 'medium')
-            if severity == 'critical':
-                penalty += 0.3
-            elif severity == 'high':
-                penalty += 0.2
-            elif severity == 'medium':
-                penalty += 0.1
-            elif severity == 'low':
-                penalty += 0.05
+        # 图像一致性分数（无图像时默认0.8）和问题扣分
+        average_image_score, penalty = _aggregate_scores(
+            [result.match_score for result in image_consistency_results],
+            (issue.get('severity', 'medium') for issue in consistency_issues),
+            default_average=0.8
+        )
+        image_score = average_image_score * 0.5
 
         # 综合分数
         final_score = max(0.0, base_score + image_score - penalty)
@@ -572,27 +1006,42 @@ class CharacterConsistencyAgent:
     async def _apply_consistency_corrections(
         self,
         consistency_results: Dict[str, Dict[str, Any]],
-        project_path: str
+        project_path: str,
+        semaphore: Optional[asyncio.Semaphore] = None
     ) -> Dict[str, Any]:
         """应用一致性修正"""
         logger.info("应用一致性修正...")
+        semaphore = semaphore or asyncio.Semaphore(_MAX_CONCURRENT_AI_CALLS)
 
         correction_results = {}
+        characters_to_correct = []
 
         for character_name, result in consistency_results.items():
             if result.get('needs_correction', False):
-                correction_result = await self._correct_character_consistency(
-                    character_name, result, project_path
-                )
-                correction_results[character_name] = correction_result
+                correction_results[character_name] = None
+                characters_to_correct.append(character_name)
             else:
                 correction_results[character_name] = {
                     'status': 'no_correction_needed',
                     'message': '角色一致性良好，无需修正'
                 }
 
+        # 并发修正需要修正的角色
+        corrections = await asyncio.gather(*[
+            self._run_limited(semaphore, self._correct_character_consistency(
+                character_name, consistency_results[character_name], project_path
+            ))
+            for character_name in characters_to_correct
+        ])
+        correction_results.update(zip(characters_to_correct, corrections))
+
         return correction_results
 
+    async def _run_limited(self, semaphore: asyncio.Semaphore, coroutine: Awaitable[T]) -> T:
+        """在信号量限制下执行协程，控制并发的AI调用数量"""
+        async with semaphore:
+            return await coroutine
+
     async def _correct_character_consistency(
         self,
         character_name: str,
@@ -600,7 +1049,7 @@ class CharacterConsistencyAgent:
         project_path: str
     ) -> Dict[str, Any]:
         """修正单个角色的一致性问题"""
-        logger.info(f"修正角色 {character_name} 的一致性问题...")
+        logger.info("修正角色 %s 的一致性问题...", character_name)
 
         try:
             issues = consistency_result.get('consistency_issues', [])
@@ -612,10 +1061,10 @@ class CharacterConsistencyAgent:
 角色姓名：{character_name}
 一致性分数：{consistency_result.get('consistency_score', 0.0)}
 发现的问题：
-{json.dumps(issues, ensure_ascii=False, indent=2)}
+{_json_dumps(issues, indent=True)}
 
 角色特征：
-{json.dumps(consistency_result.get('character_features', {}), ensure_ascii=False, indent=2)}
+{_json_dumps(consistency_result.get('character_features', {}), indent=True)}
 
 请提供：
 1. 具体的修正建议
@@ -643,13 +1092,14 @@ class CharacterConsistencyAgent:
             result = await self.ai_service.generate_text(
                 prompt=correction_prompt,
                 model_preference="seedream",
-                max_tokens=8000,
+                max_tokens=_CORRECTION_MAX_TOKENS,
+                enforce_max_tokens=True,
                 temperature=0.3
             )
 
             # 解析结果
             try:
-                correction_data = json.loads(result)
+                correction_data = _loads_ai_json(result)
 
                 return {
                     'status': 'success',
@@ -660,7 +1110,7 @@ class CharacterConsistencyAgent:
                 }
 
             except json.JSONDecodeError:
-                logger.warning(f"角色 {character_name} 一致性修正建议解析失败")
+                logger.warning("角色 %s 一致性修正建议解析失败", character_name)
 
                 return {
                     'status': 'partial_success',
@@ -678,7 +1128,7 @@ class CharacterConsistencyAgent:
                 }
 
         except Exception as e:
-            logger.error(f"角色 {character_name} 一致性修正失败: {e}")
+            logger.error("角色 %s 一致性修正失败: %s", character_name, e)
             return {
                 'status': 'error',
                 'error': str(e)
@@ -691,21 +1141,20 @@ class CharacterConsistencyAgent:
     ) -> Dict[str, Any]:
         """生成一致性报告"""
         total_characters = len(consistency_results)
-        characters_with_issues = sum(1 for result in consistency_results.values() if result.get('needs_correction', False))
         applied_corrections = sum(1 for result in correction_results.values() if result.get('status') == 'success')
 
-        # 计算平均一致性分数
-        scores = [result.get('consistency_score', 0.0) for result in consistency_results.values()]
-        average_score = sum(scores) / len(scores) if scores else 0.0
-
-        # 统计问题类型
-        issue_types = {}
+        # 单次遍历：统计需修正角色数、总分和问题类型
+        characters_with_issues = 0
+        scores = []
+        issue_types = Counter()
         for result in consistency_results.values():
-            for issue in result.get('consistency_issues', []):
-                issue_type = issue.get('issue_type', 'unknown')
-                if issue_type not in issue_types:
-                    issue_types[issue_type] = 0
-                issue_types[issue_type] += 1
+            scores.append(result.get('consistency_score', 0.0))
+            if result.get('needs_correction', False):
+                characters_with_issues += 1
+            issue_types.update(issue.get('issue_type', 'unknown') for issue in result.get('consistency_issues', []))
+
+        # 计算平均一致性分数
+        average_score, _ = _aggregate_scores(scores)
 
         return {
             'summary': {
@@ -713,17 +1162,18 @@ class CharacterConsistencyAgent:
                 'characters_with_issues': characters_with_issues,
                 'applied_corrections': applied_corrections,
                 'average_consistency_score': round(average_score, 3),
-                'issue_distribution': issue_types
+                'issue_distribution': dict(issue_types)
             },
-            'recommendations': self._generate_overall_recommendations(consistency_results),
+            'recommendations': self._generate_overall_recommendations(consistency_results, issue_types),
             'report_generated_time': datetime.now().isoformat()
         }
 
     def _generate_overall_recommendations(
         self,
-        consistency_results: Dict[str, Dict[str, Any]]
+        consistency_results: Dict[str, Dict[str, Any]],
+        issue_types: Optional[Counter] = None
     ) -> List[str]:
-        """生成整体建议"""
+        """生成整体建议（issue_types 为已统计的问题类型分布，未提供时重新统计）"""
         recommendations = []
 
         # 基于结果生成建议
@@ -732,16 +1182,15 @@ class CharacterConsistencyAgent:
             recommendations.append(f"重点关注角色 {', '.join(low_score_characters)} 的一致性改进")
 
         # 检查常见问题
-        common_issues = {}
-        for result in consistency_results.values():
-            for issue in result.get('consistency_issues', []):
-                issue_type = issue.get('issue_type', 'unknown')
-                if issue_type not in common_issues:
-                    common_issues[issue_type] = 0
-                common_issues[issue_type] += 1
-
-        if common_issues:
-            most_common_issue = max(common_issues, key=common_issues.get)
+        if issue_types is None:
+            issue_types = Counter(
+                issue.get('issue_type', 'unknown')
+                for result in consistency_results.values()
+                for issue in result.get('consistency_issues', [])
+            )
+
+        if issue_types:
+            most_common_issue = issue_types.most_common(1)[0][0]
             recommendations.append(f"优先解决 {most_common_issue} 类型的一致性问题")
 
         # 通用建议
@@ -761,8 +1210,10 @@ class CharacterConsistencyAgent:
         if not consistency_results:
             return 0.0
 
-        scores = [result.get('consistency_score', 0.0) for result in consistency_results.values()]
-        return round(sum(scores) / len(scores), 3)
+        average_score, _ = _aggregate_scores(
+            [result.get('consistency_score', 0.0) for result in consistency_results.values()]
+        )
+        return round(average_score, 3)
 
 
 # 创建单例实例
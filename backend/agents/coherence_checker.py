@@ -6,20 +6,101 @@ Coherence Checker Agent
 Responsible for verifying the quality of compressed text, checking logical coherence, character consistency, timeline coherence, etc.
 """
 
+import asyncio
+import copy
+import hashlib
 import logging
 import re
-from typing import Dict, Any, List, Optional
-import json
+from collections import Counter, OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
-from services.ai_service import AIService
+import orjson
+
+from services.ai_service import AIService, get_shared_ai_service
 
 logger = logging.getLogger(__name__)
 
+# 同时进行的AI调用上限，避免并发请求触发限流
+_MAX_CONCURRENT_AI_CALLS = 4
+
+# 连贯性检查结果缓存的最大条目数（按最近使用淘汰）
+_RESULT_CACHE_MAX_SIZE = 64
+
+# 压缩后文本短于该长度时不调用AI（文本过短，AI分析没有意义），返回跳过检查的中性结果
+_MIN_CHECK_TEXT_LENGTH = 20
+# 跳过检查时使用的中性分数（与文本压缩流程中连贯性的默认基准一致，不奖励也不惩罚）
+_NEUTRAL_COHERENCE_SCORE = 0.8
+
+# 备选方案的原因 -> (问题严重程度, 问题描述, 改进建议)
+_FALLBACK_REASONS = {
+    'system_error': ('medium', '连贯性检查系统出现错误', '建议手动检查文本连贯性'),
+    'empty_text': ('high', '压缩后文本为空，无法进行连贯性分析', '建议重新执行压缩流程，确保文本完整性'),
+}
+
+# 提示词中嵌入文本的最大字符数，超出部分保留首尾、省略中间
+_PROMPT_TEXT_MAX_CHARS = 8000
+
+# 问题严重程度编号及对应权重（按编号索引）
+_SEVERITY_IDS = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+_SEVERITY_WEIGHTS = (0.1, 0.3, 0.6, 1.0)
+
+# 问题类型位标记及对应的改进建议（按输出顺序排列）
+_T_LOGIC = 1
+_T_CHAR = 2
+_T_TIME = 4
+_T_SCENE = 8
+_T_COMPLETE = 16
+_ISSUE_TYPE_BITS = {
+    'logical_gap': _T_LOGIC,
+    'character_consistency': _T_CHAR,
+    'timeline_consistency': _T_TIME,
+    'scene_transition': _T_SCENE,
+    'completeness': _T_COMPLETE
+}
+_ISSUE_RECOMMENDATIONS = (
+    (_T_LOGIC, "建议重新梳理故事逻辑，确保因果关系合理"),
+    (_T_CHAR, "建议检查角色设定，确保角色性格和行为一致"),
+    (_T_TIME, "建议检查时间线，修复时间逻辑矛盾"),
+    (_T_SCENE, "建议增加场景过渡描述，使场景转换更自然"),
+    (_T_COMPLETE, "建议重新执行压缩流程，确保文本完整性")
+)
+
+# 预编译的文本扫描正则
+# 句末标点统一转换为句号后再按句号切分，等价于按 [。！？；] 切分
+_SENTENCE_END_TABLE = str.maketrans('！？；', '。。。')
+# 段落分隔：两个及以上换行（兼容 \r\n 与仅含空白的空行）
+_PARA_SPLIT = re.compile(r'\s*\n\s*\n\s*')
+_PRONOUN_STUB = re.compile(r'^[他她它们][，。！？]?$')
+# 段落合法的起始字符：除字母、数字、汉字（str.isalnum，与正则 \w 判定一致）外还允许这些
+_PARA_START_EXTRA_CHARS = frozenset('_「『')
+_SCENE_MARKERS = re.compile(r'(室内|室外|家中|公司|学校|街头|公园|餐厅)')
+# 所有时间标记合并为一个交替模式，单次扫描即可取出全部标记
+_TIME_MARKERS = re.compile(
+    r'今天|昨天|明天|前天|后天'
+    r'|早上|中午|下午|晚上|深夜'
+    r'|春天|夏天|秋天|冬天'
+    r'|第一天|第二天|第三天'
+    r'|一周后|一个月后|一年后'
+)
+
+
+def _clip_text(text: str, max_chars: int = _PROMPT_TEXT_MAX_CHARS) -> str:
+    """截断过长的文本用于提示词：保留开头和结尾，中间以省略标记代替"""
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n…（中间内容已省略）…\n{text[-half:]}"
+
 
 class CoherenceIssue:
     """连贯性问题数据结构"""
 
+    __slots__ = (
+        'issue_type', 'severity', 'description', 'location',
+        'suggestion', 'affected_elements', 'timestamp', 'severity_id'
+    )
+
     def __init__(
         self,
         issue_type: str,
@@ -31,14 +112,19 @@ class CoherenceIssue:
     ):
         self.issue_type = issue_type
         self.severity = severity
+        # AI返回的未知严重程度按 medium 计
+        self.severity_id = _SEVERITY_IDS.get(severity, _SEVERITY_IDS['medium'])
         self.description = description
         self.location = location
         self.suggestion = suggestion
         self.affected_elements = affected_elements or []
-        self.timestamp = datetime.now().isoformat()
+        # 时间戳在首次序列化时才生成
+        self.timestamp: Optional[str] = None
 
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式"""
+        """转换为字典格式（直接构造字典字面量，比 attrgetter/asdict 等通用方式更快）"""
+        if self.timestamp is None:
+            self.timestamp = datetime.now().isoformat()
         return {
             'issue_type': self.issue_type,
             'severity': self.severity,
@@ -50,9 +136,24 @@ class CoherenceIssue:
         }
 
 
+def _issues_to_dicts(issues: List[CoherenceIssue]) -> List[Dict[str, Any]]:
+    """将问题列表批量转换为字典列表（同一批问题共用一个时间戳）"""
+    if issues:
+        timestamp = datetime.now().isoformat()
+        for issue in issues:
+            if issue.timestamp is None:
+                issue.timestamp = timestamp
+    return list(map(CoherenceIssue.to_dict, issues))
+
+
 class CoherenceScore:
     """连贯性分数数据结构"""
 
+    __slots__ = (
+        'overall_score', 'logical_coherence', 'character_coherence',
+        'temporal_coherence', 'plot_coherence', 'emotional_coherence'
+    )
+
     def __init__(
         self,
         overall_score: float,
@@ -84,8 +185,9 @@ class CoherenceScore:
 class CoherenceChecker:
     """连贯性检查器"""
 
-    def __init__(self):
-        self.ai_service = AIService()
+    def __init__(self, ai_service: Optional[AIService] = None):
+        # 默认复用进程内共享的AI服务实例
+        self.ai_service = ai_service or get_shared_ai_service()
 
         # 连贯性检查维度
         self.check_dimensions = {
@@ -96,13 +198,11 @@ class CoherenceChecker:
             'emotional': '情感连贯性'
         }
 
-        # 问题严重程度权重
-        self.severity_weights = {
-            'low': 0.1,
-            'medium': 0.3,
-            'high': 0.6,
-            'critical': 1.0
-        }
+        # 连贯性检查结果缓存：输入内容哈希 -> 检查结果
+        self._result_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        # AI调用失败（含结果无法解析而使用默认分数）的累计次数；
+        # 检查期间有增加时结果含有备选分数，不写入缓存
+        self._ai_failure_count = 0
 
     async def check_coherence(
         self,
@@ -125,20 +225,30 @@ class CoherenceChecker:
         """
         logger.info("开始连贯性检查...")
 
-        try:
-            # 1. 基础连贯性检查
-            basic_results = await self._basic_coherence_check(
-                original_text, compressed_text
-            )
+        # 文本为空时压缩结果无效；文本过短（如一行标题）时不作评判，两种情况都不发起AI调用
+        stripped_length = len(compressed_text.strip())
+        if stripped_length == 0:
+            return self._fallback_coherence_check(compressed_text, reason='empty_text')
+        if stripped_length < _MIN_CHECK_TEXT_LENGTH:
+            return self._skipped_coherence_check()
 
-            # 2. AI辅助连贯性分析
-            ai_results = await self._ai_coherence_analysis(
-                original_text, compressed_text, text_analysis
-            )
+        # 相同输入直接复用之前的检查结果
+        cache_key = self._result_cache_key(
+            original_text, compressed_text, text_analysis, compression_level
+        )
+        cached_results = self._result_cache.get(cache_key) if cache_key else None
+        if cached_results is not None:
+            self._result_cache.move_to_end(cache_key)
+            logger.info("命中连贯性检查缓存")
+            return copy.deepcopy(cached_results)
 
-            # 3. 专项检查
-            specialized_results = await self._specialized_checks(
-                original_text, compressed_text, text_analysis
+        ai_failures_before = self._ai_failure_count
+        try:
+            # 1-3. 基础检查、AI辅助分析与专项检查互不依赖，并发执行
+            basic_results, ai_results, specialized_results = await asyncio.gather(
+                self._basic_coherence_check(original_text, compressed_text),
+                self._ai_coherence_analysis(original_text, compressed_text, text_analysis),
+                self._specialized_checks(original_text, compressed_text, text_analysis)
             )
 
             # 4. 整合结果
@@ -146,7 +256,12 @@ class CoherenceChecker:
                 basic_results, ai_results, specialized_results
             )
 
-            logger.info(f"连贯性检查完成，总体得分: {final_results['coherence_score'].overall_score:.2f}")
+            logger.info(f"连贯性检查完成，总体得分: {final_results['coherence_score']['overall_score']:.2f}")
+
+            # 只缓存AI检查全部成功的结果，AI服务恢复后相同输入会重新检查
+            # （并发的其他检查失败时也会跳过缓存，只会少缓存、不会缓存备选结果）
+            if cache_key and self._ai_failure_count == ai_failures_before:
+                self._cache_result(cache_key, final_results)
 
             return final_results
 
@@ -154,6 +269,39 @@ class CoherenceChecker:
             logger.error(f"连贯性检查失败: {e}")
             return self._fallback_coherence_check(compressed_text)
 
+    def _result_cache_key(
+        self,
+        original_text: str,
+        compressed_text: str,
+        text_analysis: Optional[Dict[str, Any]],
+        compression_level: Optional[str]
+    ) -> Optional[bytes]:
+        """根据检查输入计算缓存键，输入无法序列化时返回None（不缓存）"""
+        try:
+            analysis_bytes = orjson.dumps(
+                text_analysis, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            return None
+
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (
+            original_text.encode(),
+            compressed_text.encode(),
+            analysis_bytes,
+            (compression_level or '').encode()
+        ):
+            digest.update(part)
+            digest.update(b'\x00')
+        return digest.digest()
+
+    def _cache_result(self, cache_key: bytes, results: Dict[str, Any]):
+        """缓存检查结果，超出容量时淘汰最久未使用的条目"""
+        self._result_cache[cache_key] = copy.deepcopy(results)
+        self._result_cache.move_to_end(cache_key)
+        while len(self._result_cache) > _RESULT_CACHE_MAX_SIZE:
+            self._result_cache.popitem(last=False)
+
     async def _basic_coherence_check(
         self,
         original_text: str,
@@ -191,8 +339,12 @@ class CoherenceChecker:
                 suggestion='可能丢失了过多重要信息'
             ))
 
+        # 句子与段落检查为纯正则扫描，放到线程中执行以免阻塞事件循环
+        incomplete_sentences, paragraph_issues = await asyncio.to_thread(
+            self._basic_regex_work, compressed_text
+        )
+
         # 检查句子完整性
-        incomplete_sentences = self._check_sentence_completeness(compressed_text)
         if incomplete_sentences:
             issues.append(CoherenceIssue(
                 issue_type='sentence_completeness',
@@ -204,23 +356,26 @@ class CoherenceChecker:
             ))
 
         # 检查段落边界
-        paragraph_issues = self._check_paragraph_boundaries(compressed_text)
         issues.extend(paragraph_issues)
 
         # 计算基础分数
-        basic_score = max(0.0, 1.0 - sum(self.severity_weights[issue.severity] for issue in issues))
+        basic_score = max(0.0, 1.0 - sum(_SEVERITY_WEIGHTS[issue.severity_id] for issue in issues))
 
         return {
             'basic_score': basic_score,
-            'basic_issues': [issue.to_dict() for issue in issues]
+            'basic_issues': _issues_to_dicts(issues)
         }
 
+    def _basic_regex_work(self, text: str) -> Tuple[List[str], List[CoherenceIssue]]:
+        """基础检查中的正则扫描部分：不完整句子与段落边界问题"""
+        return self._check_sentence_completeness(text), self._check_paragraph_boundaries(text)
+
     def _check_sentence_completeness(self, text: str) -> List[str]:
         """检查句子完整性"""
         incomplete_sentences = []
 
         # 分割句子
-        sentences = re.split(r'[。！？；]', text)
+        sentences = text.translate(_SENTENCE_END_TABLE).split('。')
         sentences = [s.strip() for s in sentences if s.strip()]
 
         for sentence in sentences:
@@ -228,7 +383,7 @@ class CoherenceChecker:
             if len(sentence) < 5:
                 incomplete_sentences.append(sentence)
             # 检查是否以主语开头但没有谓语
-            elif re.match(r'^[他她它们][，。！？]?$', sentence):
+            elif _PRONOUN_STUB.match(sentence):
                 incomplete_sentences.append(sentence)
 
         return incomplete_sentences
@@ -237,27 +392,27 @@ class CoherenceChecker:
         """检查段落边界"""
         issues = []
 
-        paragraphs = text.split('\n\n')
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
+        paragraphs = [p for p in (p.strip() for p in _PARA_SPLIT.split(text)) if p]
 
-        for i, paragraph in enumerate(paragraphs):
+        for index, paragraph in enumerate(paragraphs, 1):
             # 检查段落长度
             if len(paragraph) < 10:
                 issues.append(CoherenceIssue(
                     issue_type='paragraph_length',
                     severity='low',
-                    description=f'第 {i+1} 段过短',
-                    location=f'段落 {i+1}',
+                    description=f'第 {index} 段过短',
+                    location=f'段落 {index}',
                     suggestion='考虑与相邻段落合并'
                 ))
 
-            # 检查段落开头
-            if paragraph and not re.match(r'^[\w\u4e00-\u9fff「『]', paragraph):
+            # 检查段落开头（段落已去除空白且非空；问题描述仅在命中时才格式化）
+            first_char = paragraph[0]
+            if not (first_char.isalnum() or first_char in _PARA_START_EXTRA_CHARS):
                 issues.append(CoherenceIssue(
                     issue_type='paragraph_start',
                     severity='low',
-                    description=f'第 {i+1} 段开头不规范',
-                    location=f'段落 {i+1}',
+                    description=f'第 {index} 段开头不规范',
+                    location=f'段落 {index}',
                     suggestion='检查段落开头格式'
                 ))
 
@@ -283,7 +438,7 @@ class CoherenceChecker:
 
 压缩后文本：
 ---
-{compressed_text}
+{_clip_text(compressed_text)}
 ---
 
 请从以下维度评估连贯性（0-1分）：
@@ -344,7 +499,7 @@ class CoherenceChecker:
 
             # 解析AI分析结果
             try:
-                ai_analysis = json.loads(analysis_result)
+                ai_analysis = orjson.loads(analysis_result)
 
                 # 提取各维度分数
                 scores = {}
@@ -374,16 +529,18 @@ class CoherenceChecker:
                 return {
                     'ai_scores': scores,
                     'ai_overall_score': overall_score,
-                    'ai_issues': [issue.to_dict() for issue in issues],
+                    'ai_issues': _issues_to_dicts(issues),
                     'ai_assessment': overall_assessment
                 }
 
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 logger.warning("AI连贯性分析结果解析失败")
+                self._ai_failure_count += 1
                 return self._fallback_ai_analysis(compressed_text)
 
         except Exception as e:
             logger.error(f"AI连贯性分析失败: {e}")
+            self._ai_failure_count += 1
             return self._fallback_ai_analysis(compressed_text)
 
     async def _specialized_checks(
@@ -395,66 +552,260 @@ class CoherenceChecker:
         """专项检查"""
         logger.info("执行专项连贯性检查...")
 
-        specialized_issues = []
+        main_characters = [
+            character_info
+            for character_info in (text_analysis or {}).get('main_characters', [])
+            if character_info.get('name', '')
+        ]
+
+        # 角色、场景、时间线、逻辑四项检查合并为一次AI调用
+        specialized_issues = await self._combined_specialized_check(compressed_text, main_characters)
+
+        if specialized_issues is None:
+            # 合并检查结果无法解析时，退回逐项检查
+            specialized_issues = []
+            if main_characters:
+                specialized_issues.extend(
+                    await self._check_character_consistency(compressed_text, main_characters)
+                )
+            specialized_issues.extend(await self._check_scene_transitions(compressed_text))
+            specialized_issues.extend(await self._check_timeline_consistency(compressed_text))
+            specialized_issues.extend(await self._check_logical_gaps(compressed_text))
+
+        return {
+            'specialized_issues': _issues_to_dicts(specialized_issues),
+            'specialized_score': max(0.0, 1.0 - sum(_SEVERITY_WEIGHTS[issue.severity_id] for issue in specialized_issues))
+        }
+
+    async def _combined_specialized_check(
+        self,
+        text: str,
+        main_characters: List[Dict[str, Any]]
+    ) -> Optional[List[CoherenceIssue]]:
+        """
+        合并专项检查：一次AI调用同时完成角色、场景、时间线与逻辑检查
+
+        Returns:
+            问题列表；AI返回结果无法解析时返回None，由调用方退回逐项检查
+        """
+        scene_markers, time_markers = await asyncio.to_thread(self._scan_markers, text)
 
-        # 1. 角色一致性专项检查
-        if text_analysis and 'main_characters' in text_analysis:
-            character_issues = await self._check_character_consistency(
-                compressed_text, text_analysis['main_characters']
+        try:
+            combined_result = await self.ai_service.generate_text(
+                prompt=self._specialized_combined_prompt(
+                    text, main_characters, scene_markers, time_markers
+                ),
+                model_preference="seedream",
+                max_tokens=1200,
+                temperature=0.2
+            )
+            combined = orjson.loads(combined_result)
+
+        except orjson.JSONDecodeError:
+            combined = None
+
+        except Exception as e:
+            logger.error(f"合并专项检查失败: {e}")
+            self._ai_failure_count += 1
+            combined = {}
+
+        if not isinstance(combined, dict):
+            logger.warning("合并专项检查结果解析失败，改为逐项检查")
+            return None
+
+        issues = [
+            issue for issue in (
+                self._check_character_presence(text, character_info)
+                for character_info in main_characters
             )
-            specialized_issues.extend(character_issues)
+            if issue
+        ]
 
-        # 2. 场景转换检查
-        scene_issues = await self._check_scene_transitions(compressed_text)
-        specialized_issues.extend(scene_issues)
+        character_names = {character_info['name'] for character_info in main_characters}
+        for entry in combined.get('character') or []:
+            if (
+                isinstance(entry, dict)
+                and entry.get('has_issue')
+                and entry.get('name') in character_names
+            ):
+                issues.append(self._character_issue(entry['name'], str(entry.get('detail', ''))))
+
+        # 仅采纳提示词中实际要求检查的部分
+        section_builders = (
+            ('scene', len(scene_markers) > 1, self._scene_issue),
+            ('timeline', len(time_markers) > 1, self._timeline_issue),
+            ('logic', True, self._logic_issue),
+        )
+        for key, requested, build_issue in section_builders:
+            section = combined.get(key)
+            if requested and isinstance(section, dict) and section.get('has_issue'):
+                issues.append(build_issue(str(section.get('detail', ''))))
 
-        # 3. 时间线检查
-        timeline_issues = await self._check_timeline_consistency(compressed_text)
-        specialized_issues.extend(timeline_issues)
+        return issues
 
-        # 4. 逻辑漏洞检查
-        logic_issues = await self._check_logical_gaps(compressed_text)
-        specialized_issues.extend(logic_issues)
+    def _scan_markers(self, text: str) -> Tuple[List[str], List[str]]:
+        """扫描文本中的场景标记与时间标记"""
+        return _SCENE_MARKERS.findall(text), _TIME_MARKERS.findall(text)
 
-        return {
-            'specialized_issues': [issue.to_dict() for issue in specialized_issues],
-            'specialized_score': max(0.0, 1.0 - sum(self.severity_weights[issue.severity] for issue in specialized_issues))
-        }
+    def _specialized_combined_prompt(
+        self,
+        text: str,
+        main_characters: List[Dict[str, Any]],
+        scene_markers: List[str],
+        time_markers: List[str]
+    ) -> str:
+        """构建合并专项检查的提示词"""
+        sections = []
+
+        if main_characters:
+            sections.append(f"""【角色一致性】
+主要角色：{orjson.dumps(main_characters).decode()}
+请检查每个角色的性格、行为是否与描述一致，语言风格是否统一。""")
+
+        if len(scene_markers) > 1:
+            sections.append(f"""【场景转换】
+场景序列：{" -> ".join(scene_markers)}
+请评估场景转换是否自然，是否存在突兀之处。""")
+
+        if len(time_markers) > 1:
+            sections.append(f"""【时间线】
+识别到的时间标记：{', '.join(time_markers)}
+请评估时间线是否合理，有无矛盾之处。""")
+
+        sections.append("""【逻辑漏洞】
+请检查因果关系是否合理、事件发展是否自然，是否存在逻辑漏洞或前后矛盾。""")
+
+        sections_text = "\n\n".join(sections)
+
+        return f"""
+请对以下文本进行连贯性专项检查：
+
+文本内容：
+---
+{_clip_text(text)}
+---
+
+{sections_text}
+
+请以JSON格式返回检查结果，未要求检查的部分返回空值；detail中描述具体位置和改进建议：
+{{
+    "character": [{{"name": "角色名", "has_issue": false, "detail": ""}}],
+    "scene": {{"has_issue": false, "detail": ""}},
+    "timeline": {{"has_issue": false, "detail": ""}},
+    "logic": {{"has_issue": false, "detail": ""}}
+}}
+"""
+
+    def _check_character_presence(
+        self,
+        text: str,
+        character_info: Dict[str, Any]
+    ) -> Optional[CoherenceIssue]:
+        """检查主要角色是否出现在文本中"""
+        character_name = character_info.get('name', '')
+
+        # 检查角色出现频率（角色名按字面匹配，不作为正则解析）
+        appearances = text.count(character_name)
+        if appearances == 0 and character_info.get('importance', '') == 'main':
+            return CoherenceIssue(
+                issue_type='character_consistency',
+                severity='high',
+                description=f'主要角色 {character_name} 未在压缩文本中出现',
+                location='全文',
+                suggestion='确保主要角色在压缩文本中得到体现',
+                affected_elements=[character_name]
+            )
+
+        return None
+
+    def _character_issue(self, character_name: str, detail: str) -> CoherenceIssue:
+        """构建角色一致性问题"""
+        return CoherenceIssue(
+            issue_type='character_consistency',
+            severity='medium',
+            description=f'角色 {character_name} 存在一致性问题',
+            location='全文',
+            suggestion=detail[:200],  # 截取前200字符作为建议
+            affected_elements=[character_name]
+        )
+
+    def _scene_issue(self, detail: str) -> CoherenceIssue:
+        """构建场景转换问题"""
+        return CoherenceIssue(
+            issue_type='scene_transition',
+            severity='medium',
+            description='场景转换可能过于突兀',
+            location='全文',
+            suggestion=detail[:200]
+        )
+
+    def _timeline_issue(self, detail: str) -> CoherenceIssue:
+        """构建时间线问题"""
+        return CoherenceIssue(
+            issue_type='timeline_consistency',
+            severity='high',
+            description='时间线存在逻辑矛盾',
+            location='全文',
+            suggestion=detail[:200]
+        )
+
+    def _logic_issue(self, detail: str) -> CoherenceIssue:
+        """构建逻辑漏洞问题"""
+        return CoherenceIssue(
+            issue_type='logical_gap',
+            severity='medium',
+            description='文本存在逻辑问题',
+            location='全文',
+            suggestion=detail[:300]
+        )
 
     async def _check_character_consistency(
         self,
         text: str,
         main_characters: List[Dict[str, Any]]
     ) -> List[CoherenceIssue]:
-        """检查角色一致性"""
-        issues = []
+        """检查角色一致性（各角色的AI检查并发执行）"""
+        semaphore = asyncio.Semaphore(_MAX_CONCURRENT_AI_CALLS)
+        results = await asyncio.gather(
+            *(
+                self._check_one_character(text, character_info, semaphore)
+                for character_info in main_characters
+                if character_info.get('name', '')
+            ),
+            return_exceptions=True
+        )
 
-        for character_info in main_characters:
-            character_name = character_info.get('name', '')
-            if not character_name:
+        issues = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"角色一致性检查失败: {result}")
+                self._ai_failure_count += 1
                 continue
+            issues.extend(result)
 
-            # 检查角色出现频率
-            appearances = len(re.findall(character_name, text))
-            if appearances == 0 and character_info.get('importance', '') == 'main':
-                issues.append(CoherenceIssue(
-                    issue_type='character_consistency',
-                    severity='high',
-                    description=f'主要角色 {character_name} 未在压缩文本中出现',
-                    location='全文',
-                    suggestion='确保主要角色在压缩文本中得到体现',
-                    affected_elements=[character_name]
-                ))
+        return issues
 
-            # AI辅助角色一致性检查
-            try:
-                character_check_prompt = f"""
+    async def _check_one_character(
+        self,
+        text: str,
+        character_info: Dict[str, Any],
+        semaphore: asyncio.Semaphore
+    ) -> List[CoherenceIssue]:
+        """检查单个角色的一致性"""
+        character_name = character_info.get('name', '')
+
+        presence_issue = self._check_character_presence(text, character_info)
+        issues = [presence_issue] if presence_issue else []
+
+        # AI辅助角色一致性检查
+        try:
+            character_check_prompt = f"""
 请检查角色 {character_name} 在以下文本中的表现一致性：
 
-角色描述：{json.dumps(character_info, ensure_ascii=False)}
+角色描述：{orjson.dumps(character_info).decode()}
 文本内容：
 ---
-{text}
+{_clip_text(text)}
 ---
 
 请检查：
@@ -465,26 +816,22 @@ class CoherenceChecker:
 如发现问题，请描述具体位置和改进建议。
 """
 
+            async with semaphore:
                 check_result = await self.ai_service.generate_text(
                     prompt=character_check_prompt,
                     model_preference="seedream",
-                    max_tokens=8000,
+                    max_tokens=200,
+                    enforce_max_tokens=True,
                     temperature=0.2
                 )
 
-                # 简单解析结果
-                if '不一致' in check_result or '问题' in check_result:
-                    issues.append(CoherenceIssue(
-                        issue_type='character_consistency',
-                        severity='medium',
-                        description=f'角色 {character_name} 存在一致性问题',
-                        location='全文',
-                        suggestion=check_result[:200],  # 截取前200字符作为建议
-                        affected_elements=[character_name]
-                    ))
+            # 简单解析结果
+            if '不一致' in check_result or '问题' in check_result:
+                issues.append(self._character_issue(character_name, check_result))
 
-            except Exception as e:
-                logger.error(f"角色 {character_name} 一致性检查失败: {e}")
+        except Exception as e:
+            logger.error(f"角色 {character_name} 一致性检查失败: {e}")
+            self._ai_failure_count += 1
 
         return issues
 
@@ -493,7 +840,7 @@ class CoherenceChecker:
         issues = []
 
         # 识别场景标记
-        scene_markers = re.findall(r'(室内|室外|家中|公司|学校|街头|公园|餐厅)', text)
+        scene_markers = _SCENE_MARKERS.findall(text)
 
         # 检查场景转换是否突兀
         if len(scene_markers) > 1:
@@ -520,21 +867,17 @@ class CoherenceChecker:
                 transition_result = await self.ai_service.generate_text(
                     prompt=transition_prompt,
                     model_preference="seedream",
-                    max_tokens=8000,
+                    max_tokens=200,
+                    enforce_max_tokens=True,
                     temperature=0.2
                 )
 
                 if '突兀' in transition_result or '不自然' in transition_result:
-                    issues.append(CoherenceIssue(
-                        issue_type='scene_transition',
-                        severity='medium',
-                        description='场景转换可能过于突兀',
-                        location='全文',
-                        suggestion=transition_result[:200]
-                    ))
+                    issues.append(self._scene_issue(transition_result))
 
             except Exception as e:
                 logger.error(f"场景转换检查失败: {e}")
+                self._ai_failure_count += 1
 
         return issues
 
@@ -543,18 +886,7 @@ class CoherenceChecker:
         issues = []
 
         # 识别时间标记
-        time_patterns = [
-            r'(今天|昨天|明天|前天|后天)',
-            r'(早上|中午|下午|晚上|深夜)',
-            r'(春天|夏天|秋天|冬天)',
-            r'(第一天|第二天|第三天)',
-            r'(一周后|一个月后|一年后)'
-        ]
-
-        time_markers = []
-        for pattern in time_patterns:
-            matches = re.findall(pattern, text)
-            time_markers.extend(matches)
+        time_markers = _TIME_MARKERS.findall(text)
 
         # 检查时间标记的逻辑性
         if len(time_markers) > 1:
@@ -575,21 +907,17 @@ class CoherenceChecker:
                 timeline_result = await self.ai_service.generate_text(
                     prompt=timeline_prompt,
                     model_preference="seedream",
-                    max_tokens=8000,
+                    max_tokens=250,
+                    enforce_max_tokens=True,
                     temperature=0.2
                 )
 
                 if '矛盾' in timeline_result or '不合理' in timeline_result:
-                    issues.append(CoherenceIssue(
-                        issue_type='timeline_consistency',
-                        severity='high',
-                        description='时间线存在逻辑矛盾',
-                        location='全文',
-                        suggestion=timeline_result[:200]
-                    ))
+                    issues.append(self._timeline_issue(timeline_result))
 
             except Exception as e:
                 logger.error(f"时间线检查失败: {e}")
+                self._ai_failure_count += 1
 
         return issues
 
@@ -604,7 +932,7 @@ class CoherenceChecker:
 
 文本内容：
 ---
-{text}
+{_clip_text(text)}
 ---
 
 请检查：
@@ -619,21 +947,17 @@ class CoherenceChecker:
             logic_result = await self.ai_service.generate_text(
                 prompt=logic_prompt,
                 model_preference="seedream",
-                max_tokens=8000,
+                max_tokens=250,
+                enforce_max_tokens=True,
                 temperature=0.2
             )
 
             if '漏洞' in logic_result or '矛盾' in logic_result or '问题' in logic_result:
-                issues.append(CoherenceIssue(
-                    issue_type='logical_gap',
-                    severity='medium',
-                    description='文本存在逻辑问题',
-                    location='全文',
-                    suggestion=logic_result[:300]
-                ))
+                issues.append(self._logic_issue(logic_result))
 
         except Exception as e:
             logger.error(f"逻辑漏洞检查失败: {e}")
+            self._ai_failure_count += 1
 
         return issues
 
@@ -676,11 +1000,10 @@ class CoherenceChecker:
         )
 
         # 统计问题严重程度
+        severity_counts = Counter(issue.get('severity') for issue in all_issues)
         issue_summary = {
-            'critical': len([i for i in all_issues if i.get('severity') == 'critical']),
-            'high': len([i for i in all_issues if i.get('severity') == 'high']),
-            'medium': len([i for i in all_issues if i.get('severity') == 'medium']),
-            'low': len([i for i in all_issues if i.get('severity') == 'low'])
+            severity: severity_counts[severity]
+            for severity in ('critical', 'high', 'medium', 'low')
         }
 
         return {
@@ -699,25 +1022,17 @@ class CoherenceChecker:
 
     def _generate_recommendations(self, issues: List[Dict[str, Any]]) -> List[str]:
         """生成改进建议"""
-        recommendations = []
+        # 一次遍历收集出现过的问题类型
+        issue_mask = 0
+        for issue in issues:
+            issue_mask |= _ISSUE_TYPE_BITS.get(issue.get('issue_type', ''), 0)
 
         # 按问题类型生成建议
-        issue_types = set(issue.get('issue_type', '') for issue in issues)
-
-        if 'logical_gap' in issue_types:
-            recommendations.append("建议重新梳理故事逻辑，确保因果关系合理")
-
-        if 'character_consistency' in issue_types:
-            recommendations.append("建议检查角色设定，确保角色性格和行为一致")
-
-        if 'timeline_consistency' in issue_types:
-            recommendations.append("建议检查时间线，修复时间逻辑矛盾")
-
-        if 'scene_transition' in issue_types:
-            recommendations.append("建议增加场景过渡描述，使场景转换更自然")
-
-        if 'completeness' in issue_types:
-            recommendations.append("建议重新执行压缩流程，确保文本完整性")
+        recommendations = [
+            recommendation
+            for issue_bit, recommendation in _ISSUE_RECOMMENDATIONS
+            if issue_mask & issue_bit
+        ]
 
         if not recommendations:
             recommendations.append("文本连贯性良好，可以继续处理")
@@ -744,9 +1059,34 @@ class CoherenceChecker:
             }
         }
 
-    def _fallback_coherence_check(self, text: str) -> Dict[str, Any]:
-        """连贯性检查失败的备选方案"""
-        logger.warning("使用备选连贯性检查方案")
+    def _skipped_coherence_check(self) -> Dict[str, Any]:
+        """文本过短、跳过连贯性检查时的中性结果：不报告问题，视为可接受"""
+        logger.info("压缩后文本过短，跳过连贯性检查")
+
+        coherence_score = CoherenceScore(
+            overall_score=_NEUTRAL_COHERENCE_SCORE,
+            logical_coherence=_NEUTRAL_COHERENCE_SCORE,
+            character_coherence=_NEUTRAL_COHERENCE_SCORE,
+            temporal_coherence=_NEUTRAL_COHERENCE_SCORE,
+            plot_coherence=_NEUTRAL_COHERENCE_SCORE,
+            emotional_coherence=_NEUTRAL_COHERENCE_SCORE
+        )
+
+        return {
+            'coherence_score': coherence_score.to_dict(),
+            'total_issues': 0,
+            'issue_summary': {'critical': 0, 'high': 0, 'medium': 0, 'low': 0},
+            'issues': [],
+            'check_details': {'skipped': 'text_too_short'},
+            'recommendations': ["文本较短，无需进行连贯性检查"],
+            'is_acceptable': True
+        }
+
+    def _fallback_coherence_check(self, text: str, reason: str = 'system_error') -> Dict[str, Any]:
+        """连贯性检查失败（或文本为空）时的备选方案"""
+        logger.warning(f"使用备选连贯性检查方案: {reason}")
+
+        severity, description, suggestion = _FALLBACK_REASONS[reason]
 
         # 基础分数基于文本长度和结构
         base_score = 0.5
@@ -764,21 +1104,24 @@ class CoherenceChecker:
             emotional_coherence=base_score
         )
 
+        issue_summary = {'critical': 0, 'high': 0, 'medium': 0, 'low': 0}
+        issue_summary[severity] = 1
+
         return {
             'coherence_score': coherence_score.to_dict(),
             'total_issues': 1,
-            'issue_summary': {'critical': 0, 'high': 0, 'medium': 1, 'low': 0},
+            'issue_summary': issue_summary,
             'issues': [{
-                'issue_type': 'system_error',
-                'severity': 'medium',
-                'description': '连贯性检查系统出现错误',
-                'location': '系统',
-                'suggestion': '建议手动检查文本连贯性',
+                'issue_type': reason,
+                'severity': severity,
+                'description': description,
+                'location': '系统' if reason == 'system_error' else '全文',
+                'suggestion': suggestion,
                 'timestamp': datetime.now().isoformat()
             }],
             'check_details': {},
-            'recommendations': ['建议手动检查文本连贯性'],
-            'is_acceptable': base_score >= 0.6
+            'recommendations': [suggestion],
+            'is_acceptable': base_score >= 0.6 and issue_summary['high'] == 0
         }
 
 
@@ -3,77 +3,372 @@
 Cover Generator Agent
 """
 
+import asyncio
+import hashlib
 import logging
 import json
-from typing import Dict, Any, List, Optional
+import math
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from itertools import islice
+from typing import Dict, Any, List, Optional, Tuple
 
-from services.ai_service import AIService
+import orjson
+
+try:
+    from config import settings
+except Exception:
+    from backend.config import settings
+
+from services.ai_service import get_shared_ai_service
+from utils.cache_manager import FileCache, MemoryCache
+from utils.enhanced_logging import DuplicateLogFilter
 
 logger = logging.getLogger(__name__)
+# AI服务故障时重试会产生大量相同的警告和错误日志，1秒内重复的只记录一次（INFO及以下不受影响）
+logger.addFilter(DuplicateLogFilter(window_seconds=1.0))
+
+# 封面描述生成参数（采样温度可通过 COVER_TEMPERATURE 配置）
+_COVER_TEMPERATURE = settings.COVER_TEMPERATURE
+# 只需要描述正文时要求模型直接输出纯文本，完整JSON输出时多留给其余字段的余量
+_COVER_DESCRIPTION_MAX_TOKENS = 700
+_COVER_MAX_TOKENS = 1500
+
+# 封面描述缓存：相同提示在有效期内直接复用已生成的描述
+_DESCRIPTION_CACHE_TTL = 1800
+_DESCRIPTION_CACHE_MAX_SIZE = 200
+
+# 封面描述的持久化缓存（第二级），进程重启后仍可复用；只在温度为0时启用
+_DESCRIPTION_DISK_CACHE_DIR = settings.CACHE_DIR / "cover_descriptions"
+_DESCRIPTION_DISK_CACHE_TTL = 7 * 24 * 3600
+
+# 非JSON响应中的编号小标题行（"1." ~ "5."）的首字符，提取描述时跳过这些行
+_NUMBERED_LINE_DIGITS = frozenset('12345')
+
+# 流式响应中完整的 cover_description 字段（字符串值以未转义的引号结束）
+_DESCRIPTION_FIELD_KEY = '"cover_description"'
+_DESCRIPTION_FIELD = re.compile(r'"cover_description"\s*:\s*"((?:[^"\\]|\\.)*)"', re.S)
+
+# 计算缓存键前规范化文本时合并的连续空白
+_WHITESPACE_RUN = re.compile(r'\s+')
+
+# JSON 响应开头：可选的空白和 ```json 代码块标记后紧跟 "{"
+_JSON_START = re.compile(r'\s*(`{3,}(?:json)?\s*)?\{')
+
+# 输出格式与少样本示例（模块级常量，所有实例共享）
+_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cover_description": {
+            "type": "string",
+            "description": "封面图像的详细描述"
+        },
+        "key_elements": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "封面的关键元素列表"
+        },
+        "color_palette": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "建议的色调方案"
+        },
+        "composition": {
+            "type": "string",
+            "description": "构图建议"
+        }
+    },
+    "required": ["cover_description", "key_elements", "color_palette", "composition"]
+}
+
+_FEWSHOT_EXAMPLES = (
+    {
+        "input": {
+            "project_info": {"name": "魔法学院", "description": "一个关于魔法学习的故事"},
+            "chapter_info": {},
+            "characters": [{"name": "小明", "description": "年轻魔法师"}],
+            "cover_type": "project",
+            "user_prompt": "想要一个神秘的魔法风格封面"
+        },
+        "output": {
+            "cover_description": "神秘的魔法学院封面，宏伟的城堡在月光下矗立，周围环绕着魔法光芒，年轻的魔法师站在城堡前，手持法杖，周围飘浮着魔法符文和星光，整体氛围神秘而梦幻",
+            "key_elements": ["魔法城堡", "月光", "年轻魔法师", "法杖", "魔法符文", "星光"],
+            "color_palette": ["深蓝色", "紫色", "金色", "银色"],
+            "composition": "中心构图，城堡作为背景，人物在中景，魔法元素作为前景装饰"
+        }
+    },
+    {
+        "input": {
+            "project_info": {"name": "都市侦探", "description": "现代都市背景的侦探故事"},
+            "chapter_info": {"title": "第一章：神秘的失踪案", "content": "侦探接到一宗失踪案"},
+            "characters": [{"name": "李侦探", "description": "经验丰富的私家侦探"}],
+            "cover_type": "chapter",
+            "user_prompt": "想要一个悬疑的氛围"
+        },
+        "output": {
+            "cover_description": "悬疑氛围的都市侦探封面，雨夜的都市街道，霓虹灯反射在湿漉漉的地面上，侦探站在阴影中，大衣领子竖起，远处有一个模糊的人影，整体色调阴暗，充满神秘感",
+            "key_elements": ["雨夜街道", "霓虹灯", "侦探", "阴影", "模糊人影", "都市背景"],
+            "color_palette": ["深蓝色", "黑色", "霓虹红", "深灰色"],
+            "composition": "前景到中景的层次构图，利用光影对比营造悬疑氛围"
+        }
+    }
+)
+
+# 预先序列化的输出格式与示例，构建提示词时直接拼接
+_OUTPUT_SCHEMA_JSON = orjson.dumps(_OUTPUT_SCHEMA).decode()
+_FEWSHOT_JSON = "\n\n".join(
+    f"输入：{orjson.dumps(example['input']).decode()}\n"
+    f"输出：{orjson.dumps(example['output']).decode()}"
+    for example in _FEWSHOT_EXAMPLES
+)
+
+# 系统提示词：与具体项目/章节无关的固定指令、输出格式和示例，作为每次请求相同的前缀
+_COVER_SYSTEM_PROMPT = f"""你是一名专业的漫画封面设计师，根据用户提供的项目/章节信息生成封面描述。
+
+封面描述需要包括:
+1. 画面主体内容
+2. 背景和环境
+3. 色彩氛围
+4. 关键元素
+5. 构图建议
+
+请用中文回答，描述要生动具体，适合AI图像生成。
+
+请只返回一个符合以下JSON Schema的JSON对象，不要添加其他内容：
+{_OUTPUT_SCHEMA_JSON}
+
+示例：
+{_FEWSHOT_JSON}
+"""
+
+# 只需要描述正文时的系统提示词：要求直接输出纯文本，不生成其余不会被使用的字段
+_FEWSHOT_TEXT = "\n\n".join(
+    f"输入：{orjson.dumps(example['input']).decode()}\n"
+    f"输出：{example['output']['cover_description']}"
+    for example in _FEWSHOT_EXAMPLES
+)
+_COVER_TEXT_SYSTEM_PROMPT = f"""你是一名专业的漫画封面设计师，根据用户提供的项目/章节信息生成封面描述。
+
+封面描述需要包括:
+1. 画面主体内容
+2. 背景和环境
+3. 色彩氛围
+4. 关键元素
+5. 构图建议
+
+请用中文回答，描述要生动具体，适合AI图像生成。
+
+请直接输出一段完整的封面描述正文，不要使用JSON或代码块，不要添加编号或标题。
+
+示例：
+{_FEWSHOT_TEXT}
+"""
+
+# 用户提示词模板：按封面类型预先拼好固定部分，每次请求只填入章节标题和详细信息
+_PROJECT_COVER_PROMPT_TEMPLATE = """
+请为这个漫画项目生成一个封面描述，需要体现整个项目的主题和风格。
+
+项目/章节信息:
+{details}
+"""
+_CHAPTER_COVER_PROMPT_TEMPLATE = """
+请为章节 '{title}' 生成一个封面描述，需要体现章节的主要内容和情节。
+
+项目/章节信息:
+{details}
+"""
+# 非 "project" 的封面类型都按章节封面处理
+_COVER_PROMPT_BUILDERS = {
+    "project": _PROJECT_COVER_PROMPT_TEMPLATE.format,
+    "chapter": _CHAPTER_COVER_PROMPT_TEMPLATE.format,
+}
+
+# 近似输入复用描述的相似度阈值（字符二元组向量的余弦相似度）
+_SIMILAR_INPUT_THRESHOLD = 0.92
+_SIMILAR_CACHE_MAX_BUCKETS = 64
+_SIMILAR_CACHE_MAX_ENTRIES_PER_BUCKET = 16
+
+
+def _normalize_text(text: Any) -> str:
+    """规范化文本：NFKC（全角转半角）、合并空白、去除首尾空白并转为小写"""
+    if not text:
+        return ""
+    return _WHITESPACE_RUN.sub(' ', unicodedata.normalize('NFKC', str(text))).strip().lower()
+
+
+def _render_cover_prompt(
+    project_info: Optional[Dict[str, Any]],
+    chapter_info: Optional[Dict[str, Any]],
+    characters: Optional[List[Dict[str, Any]]],
+    cover_type: str,
+    user_prompt: str,
+    reference_image_path: Optional[str]
+) -> str:
+    """构建封面描述的用户提示词"""
+    project_info = project_info or {}
+    chapter_info = chapter_info or {}
+
+    # 构建详细信息
+    details: List[str] = []
+
+    if project_info.get("name"):
+        details.append(f"项目名称: {project_info['name']}")
+    if project_info.get("description"):
+        details.append(f"项目描述: {project_info['description']}")
+
+    if chapter_info.get("title"):
+        details.append(f"章节标题: {chapter_info['title']}")
+    if chapter_info.get("summary"):
+        details.append(f"章节概要: {chapter_info['summary']}")
+
+    # 只取前3个主要角色，不复制角色列表
+    main_characters = ", ".join(char["name"] for char in islice(characters or (), 3))
+    if main_characters:
+        details.append(f"主要角色: {main_characters}")
+
+    if user_prompt:
+        details.append(f"用户要求: {user_prompt}")
+
+    if reference_image_path:
+        details.append(f"参考图片: 有参考图片，请参考其风格、色彩和构图来生成封面")
+
+    # 用户提示只包含本次请求的信息
+    build_prompt = _COVER_PROMPT_BUILDERS.get(cover_type, _CHAPTER_COVER_PROMPT_TEMPLATE.format)
+    user_prompt_text = build_prompt(
+        title=chapter_info.get('title', ''),
+        details="\n".join(details)
+    )
+
+    return user_prompt_text
+
+
+def _parse_cover_response(response: str) -> Optional[Dict[str, Any]]:
+    """解析AI响应：JSON对象直接解码，纯文本则去掉编号小标题行后拼接为描述"""
+    try:
+        # 尝试解析JSON响应（兼容模型用 ```json 代码块包裹的情况）
+        # 只匹配开头的空白和代码块标记，不复制整段响应
+        json_start = _JSON_START.match(response)
+        if json_start:
+            body = response[json_start.end() - 1:]
+            if json_start.group(1):
+                body = body.rstrip().rstrip('`')
+            return orjson.loads(body)
+
+        # 如果不是JSON，尝试提取描述文本
+        parts = [
+            line for line in map(str.strip, response.split('\n'))
+            if line and not (line[0] in _NUMBERED_LINE_DIGITS and line[1:2] == '.')
+        ]
+
+        if parts:
+            return {"cover_description": " ".join(parts)}
+
+        return None
+
+    except Exception as e:
+        logger.error("解析AI响应失败: %s", e)
+        return None
+
+
+class SimilarCoverCache:
+    """
+    近似输入的封面描述缓存
+
+    项目描述、章节概要等上下文常有细微的措辞差异，精确匹配缓存无法命中。
+    这里以字符二元组向量的余弦相似度衡量输入的相似程度，并要求项目名称、
+    封面类型、章节标题以及规范化后的用户要求等关键字段完全一致（分桶），
+    避免较长的共同上下文掩盖用户要求的差异而张冠李戴。
+    """
+
+    def __init__(
+        self,
+        threshold: float = _SIMILAR_INPUT_THRESHOLD,
+        max_buckets: int = _SIMILAR_CACHE_MAX_BUCKETS,
+        max_entries_per_bucket: int = _SIMILAR_CACHE_MAX_ENTRIES_PER_BUCKET
+    ):
+        self.threshold = threshold
+        self.max_buckets = max_buckets
+        self.max_entries_per_bucket = max_entries_per_bucket
+        self._buckets: "OrderedDict[Tuple[Any, ...], List[Tuple[Counter, float, str]]]" = OrderedDict()
+
+    @staticmethod
+    def _vectorize(text: str) -> Tuple[Counter, float]:
+        """将文本转换为字符二元组计数向量及其模长"""
+        grams = Counter(text[i:i + 2] for i in range(len(text) - 1)) or Counter(text)
+        return grams, math.sqrt(sum(count * count for count in grams.values()))
+
+    def get(self, bucket: Tuple[Any, ...], text: str) -> Optional[str]:
+        """查找同一分桶内与输入足够相似的描述"""
+        entries = self._buckets.get(bucket)
+        if not entries:
+            return None
+
+        grams, norm = self._vectorize(text)
+        if not norm:
+            return None
+
+        best_score, best_description = 0.0, None
+        for entry_grams, entry_norm, description in entries:
+            dot = sum(count * entry_grams[gram] for gram, count in grams.items())
+            score = dot / (norm * entry_norm)
+            if score > best_score:
+                best_score, best_description = score, description
+
+        if best_score >= self.threshold:
+            self._buckets.move_to_end(bucket)
+            return best_description
+        return None
+
+    def add(self, bucket: Tuple[Any, ...], text: str, description: str):
+        """记录输入及其生成的描述"""
+        grams, norm = self._vectorize(text)
+        if not norm:
+            return
+
+        entries = self._buckets.setdefault(bucket, [])
+        self._buckets.move_to_end(bucket)
+        entries.append((grams, norm, description))
+        if len(entries) > self.max_entries_per_bucket:
+            del entries[0]
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
 
 
 class CoverGenerator:
     """封面生成器Agent"""
 
-    def __init__(self):
-        self.ai_service = AIService()
-        self.output_schema = {
-            "type": "object",
-            "properties": {
-                "cover_description": {
-                    "type": "string",
-                    "description": "封面图像的详细描述"
-                },
-                "key_elements": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "封面的关键元素列表"
-                },
-                "color_palette": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "建议的色调方案"
-                },
-                "composition": {
-                    "type": "string",
-                    "description": "构图建议"
-                }
-            },
-            "required": ["cover_description", "key_elements", "color_palette", "composition"]
-        }
+    __slots__ = (
+        'ai_service', 'reuse_cached_descriptions', '_description_cache',
+        '_disk_cache', '_similar_cache', '_cache_lock', '_inflight'
+    )
 
-        self.fewshot_examples = [
-            {
-                "input": {
-                    "project_info": {"name": "魔法学院", "description": "一个关于魔法学习的故事"},
-                    "chapter_info": {},
-                    "characters": [{"name": "小明", "description": "年轻魔法师"}],
-                    "cover_type": "project",
-                    "user_prompt": "想要一个神秘的魔法风格封面"
-                },
-                "output": {
-                    "cover_description": "神秘的魔法学院封面，宏伟的城堡在月光下矗立，周围环绕着魔法光芒，年轻的魔法师站在城堡前，手持法杖，周围飘浮着魔法符文和星光，整体氛围神秘而梦幻",
-                    "key_elements": ["魔法城堡", "月光", "年轻魔法师", "法杖", "魔法符文", "星光"],
-                    "color_palette": ["深蓝色", "紫色", "金色", "银色"],
-                    "composition": "中心构图，城堡作为背景，人物在中景，魔法元素作为前景装饰"
-                }
-            },
-            {
-                "input": {
-                    "project_info": {"name": "都市侦探", "description": "现代都市背景的侦探故事"},
-                    "chapter_info": {"title": "第一章：神秘的失踪案", "content": "侦探接到一宗失踪案"},
-                    "characters": [{"name": "李侦探", "description": "经验丰富的私家侦探"}],
-                    "cover_type": "chapter",
-                    "user_prompt": "想要一个悬疑的氛围"
-                },
-                "output": {
-                    "cover_description": "悬疑氛围的都市侦探封面，雨夜的都市街道，霓虹灯反射在湿漉漉的地面上，侦探站在阴影中，大衣领子竖起，远处有一个模糊的人影，整体色调阴暗，充满神秘感",
-                    "key_elements": ["雨夜街道", "霓虹灯", "侦探", "阴影", "模糊人影", "都市背景"],
-                    "color_palette": ["深蓝色", "黑色", "霓虹红", "深灰色"],
-                    "composition": "前景到中景的层次构图，利用光影对比营造悬疑氛围"
-                }
-            }
-        ]
+    def __init__(self, reuse_cached_descriptions: bool = True):
+        """
+        Args:
+            reuse_cached_descriptions: 非零温度下是否仍复用缓存的描述（重试时避免重复调用AI）
+        """
+        # 复用进程内共享的AI服务实例
+        self.ai_service = get_shared_ai_service()
+        self.reuse_cached_descriptions = reuse_cached_descriptions
+        self._description_cache = MemoryCache(
+            name='cover_descriptions',
+            ttl_seconds=_DESCRIPTION_CACHE_TTL,
+            max_size=_DESCRIPTION_CACHE_MAX_SIZE
+        )
+        # 磁盘缓存跨进程保留数天，只在确定性采样（温度为0）时启用，
+        # 否则同一输入在有效期内始终得到同一份描述，失去随机采样的多样性
+        self._disk_cache = FileCache(
+            name='cover_descriptions',
+            cache_dir=str(_DESCRIPTION_DISK_CACHE_DIR),
+            ttl_seconds=_DESCRIPTION_DISK_CACHE_TTL
+        ) if _COVER_TEMPERATURE == 0 else None
+        self._similar_cache = SimilarCoverCache()
+        # 查找和写入各级缓存时会等待磁盘读写，用锁保证并发请求看到一致的各级缓存，
+        # 避免较早读出的旧描述覆盖刚写入的新描述
+        self._cache_lock = asyncio.Lock()
+        # 进行中的请求：缓存键 -> 生成结果的Future，相同请求并发到达时只调用一次AI
+        self._inflight: Dict[str, asyncio.Future] = {}
 
     async def generate_cover_description(
         self,
@@ -82,7 +377,9 @@ class CoverGenerator:
         characters: List[Dict[str, Any]],
         cover_type: str,
         user_prompt: str = "",
-        reference_image_path: Optional[str] = None
+        reference_image_path: Optional[str] = None,
+        description_only: bool = True,
+        use_cache: bool = True
     ) -> str:
         """
         生成封面描述
@@ -94,129 +391,299 @@ class CoverGenerator:
             cover_type: 封面类型
             user_prompt: 用户提供的提示
             reference_image_path: 参考图片路径
+            description_only: 是否只让模型输出描述正文；为False时按完整JSON格式（含关键元素、配色、构图）生成
+            use_cache: 是否复用已缓存的描述；为False时强制重新生成（新结果仍写入缓存）
 
         Returns:
             封面描述文本
         """
         try:
-            # 构建输入信息
-            input_data = {
-                "project_info": project_info,
-                "chapter_info": chapter_info,
-                "characters": characters,
-                "cover_type": cover_type,
-                "user_prompt": user_prompt,
-                "reference_image_path": reference_image_path
-            }
-
-            # 构建提示
-            prompt = self._build_cover_prompt(input_data)
-
-            # 调用AI服务生成封面描述
-            response = await self.ai_service.generate_text(
-                prompt=prompt,
-                temperature=0.7,
-                max_tokens=8000
+            # 系统提示词为固定前缀，只取决于输出格式
+            if description_only:
+                system_prompt, max_tokens = _COVER_TEXT_SYSTEM_PROMPT, _COVER_DESCRIPTION_MAX_TOKENS
+            else:
+                system_prompt, max_tokens = _COVER_SYSTEM_PROMPT, _COVER_MAX_TOKENS
+
+            # 缓存键只依赖规范化的输入字段，先查缓存，命中时无需构建用户提示词也不调用AI
+            cache_key = None
+            if self._caching_enabled():
+                cache_key = self._description_cache_key(
+                    system_prompt,
+                    self._canonical_prompt_input(
+                        project_info=project_info,
+                        chapter_info=chapter_info,
+                        characters=characters,
+                        cover_type=cover_type,
+                        user_prompt=user_prompt,
+                        reference_image_path=reference_image_path
+                    ),
+                    max_tokens
+                )
+                similar_input = self._similar_cache_input(
+                    project_info=project_info,
+                    chapter_info=chapter_info,
+                    characters=characters,
+                    cover_type=cover_type,
+                    user_prompt=user_prompt,
+                    reference_image_path=reference_image_path
+                )
+                if use_cache:
+                    cached_description = await self._get_cached_description(cache_key, similar_input)
+                    if cached_description is not None:
+                        return cached_description
+
+            # 构建用户提示词（只包含本次的项目/章节信息）
+            prompt = self._build_cover_prompt(
+                project_info=project_info,
+                chapter_info=chapter_info,
+                characters=characters,
+                cover_type=cover_type,
+                user_prompt=user_prompt,
+                reference_image_path=reference_image_path
             )
 
-            # 解析AI响应
-            result = self._parse_ai_response(response)
+            # 调用AI服务生成封面描述，并在描述字段完整后立即解析返回
+            # 强制重新生成时不合并到进行中的相同请求，否则拿到的仍是那次的结果
+            if cache_key and use_cache:
+                result = await self._generate_cover_result_once(cache_key, system_prompt, prompt, max_tokens)
+            else:
+                result = await self._generate_cover_result(system_prompt, prompt, max_tokens)
 
             if result and "cover_description" in result:
+                if cache_key:
+                    await self._store_description(cache_key, similar_input, result["cover_description"])
                 return result["cover_description"]
             else:
                 # 如果解析失败，返回默认描述
                 return self._get_default_description(cover_type, project_info, chapter_info)
 
         except Exception as e:
-            logger.error(f"生成封面描述失败: {e}")
+            logger.error("生成封面描述失败: %s", e, exc_info=True)
             return self._get_default_description(cover_type, project_info, chapter_info)
 
-    def _build_cover_prompt(self, input_data: Dict[str, Any]) -> str:
-        """
-        构建AI提示
-        """
-        project_info = input_data.get("project_info", {})
-        chapter_info = input_data.get("chapter_info", {})
-        characters = input_data.get("characters", [])
-        cover_type = input_data.get("cover_type", "project")
-        user_prompt = input_data.get("user_prompt", "")
-        reference_image_path = input_data.get("reference_image_path")
-
-        # 基础提示
-        if cover_type == "project":
-            base_prompt = "请为这个漫画项目生成一个封面描述，需要体现整个项目的主题和风格。"
-        else:
-            base_prompt = f"请为章节 '{chapter_info.get('title', '')}' 生成一个封面描述，需要体现章节的主要内容和情节。"
+    def _caching_enabled(self) -> bool:
+        """是否查找并复用已缓存的描述"""
+        return _COVER_TEMPERATURE == 0 or self.reuse_cached_descriptions
 
-        # 构建详细信息
-        details = []
+    async def _get_cached_description(
+        self,
+        cache_key: str,
+        similar_input: Tuple[Tuple[Any, ...], str]
+    ) -> Optional[str]:
+        """依次查找内存缓存、磁盘缓存和近似输入缓存"""
+        async with self._cache_lock:
+            cached_description = self._description_cache.get(cache_key)
+            if cached_description is not None:
+                logger.info("命中封面描述缓存")
+                return cached_description
+
+            # 内存缓存未命中时查找磁盘缓存（文件读取放到线程中执行）
+            if self._disk_cache is not None:
+                cached_description = await asyncio.to_thread(self._disk_cache.get, cache_key)
+                if cached_description is not None:
+                    logger.info("命中封面描述磁盘缓存")
+                    self._description_cache.set(cache_key, cached_description)
+                    return cached_description
+
+            # 精确匹配未命中时，查找关键字段一致且要求措辞相近的已生成描述
+            cached_description = self._similar_cache.get(*similar_input)
+            if cached_description is not None:
+                logger.info("命中近似输入的封面描述缓存")
+                self._description_cache.set(cache_key, cached_description)
+                return cached_description
 
-        if project_info.get("name"):
-            details.append(f"项目名称: {project_info['name']}")
-        if project_info.get("description"):
-            details.append(f"项目描述: {project_info['description']}")
+            return None
 
-        if chapter_info.get("title"):
-            details.append(f"章节标题: {chapter_info['title']}")
-        if chapter_info.get("summary"):
-            details.append(f"章节概要: {chapter_info['summary']}")
+    async def _store_description(
+        self,
+        cache_key: str,
+        similar_input: Tuple[Tuple[Any, ...], str],
+        description: str
+    ):
+        """将生成的描述写入各级缓存"""
+        async with self._cache_lock:
+            self._description_cache.set(cache_key, description)
+            self._similar_cache.add(*similar_input, description)
+            if self._disk_cache is not None:
+                await asyncio.to_thread(self._disk_cache.set, cache_key, description)
+
+    async def _generate_cover_result_once(
+        self,
+        cache_key: str,
+        system_prompt: str,
+        prompt: str,
+        max_tokens: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        合并并发的相同请求：已有相同请求在进行时等待其结果，而不是再调用一次AI
 
-        if characters:
-            main_characters = [char["name"] for char in characters[:3]]  # 只取前3个主要角色
-            details.append(f"主要角色: {', '.join(main_characters)}")
+        发起请求的一方失败或被取消时，等待方得到None（使用默认描述）
+        """
+        pending = self._inflight.get(cache_key)
+        if pending is not None:
+            logger.info("相同的封面描述请求正在进行，等待其结果")
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = pending
+        result = None
+        try:
+            result = await self._generate_cover_result(system_prompt, prompt, max_tokens)
+            return result
+        finally:
+            self._inflight.pop(cache_key, None)
+            pending.set_result(result)
 
-        if user_prompt:
-            details.append(f"用户要求: {user_prompt}")
+    async def _generate_cover_result(
+        self,
+        system_prompt: str,
+        prompt: str,
+        max_tokens: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        流式调用AI生成封面描述，cover_description 字段一旦完整即停止接收
 
-        if reference_image_path:
-            details.append(f"参考图片: 有参考图片，请参考其风格、色彩和构图来生成封面")
+        其余字段不会被使用，提前结束可以省去等待它们生成的时间；
+        纯文本响应（只要描述正文时）或不是预期的JSON时，读完整个响应后按原方式解析
+        """
+        response = ""
+        field_start = -1
+        incremental = True
+        stream = self.ai_service.generate_text_stream(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            temperature=_COVER_TEMPERATURE,
+            max_tokens=max_tokens
+        )
 
-        # 完整提示
-        full_prompt = f"""
-{base_prompt}
+        try:
+            async for piece in stream:
+                response += piece
+                if not incremental:
+                    continue
+                if field_start < 0:
+                    field_start = response.find(_DESCRIPTION_FIELD_KEY)
+                    if field_start < 0:
+                        continue
+
+                match = _DESCRIPTION_FIELD.match(response, field_start)
+                if match:
+                    try:
+                        # 模型常在字符串中直接输出换行等控制字符，这里用非严格模式的标准库解码
+                        return {"cover_description": json.loads(f'"{match.group(1)}"', strict=False)}
+                    except json.JSONDecodeError:
+                        # 字段内容无法按JSON字符串解码，读完整个响应后再整体解析
+                        incremental = False
+        finally:
+            await stream.aclose()
+
+        return self._parse_ai_response(response)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取封面描述缓存的统计信息（命中/未命中次数等）"""
+        return self._description_cache.get_stats()
+
+    def _description_cache_key(self, system_prompt: str, prompt_input: Dict[str, Any], max_tokens: int) -> str:
+        """根据系统提示词、规范化后的提示输入和生成参数计算缓存键"""
+        key_data = orjson.dumps(
+            {
+                "system_prompt": system_prompt,
+                "prompt_input": prompt_input,
+                "temperature": _COVER_TEMPERATURE,
+                "max_tokens": max_tokens
+            },
+            option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha256(key_data).hexdigest()
 
-项目/章节信息:
-{chr(10).join(details)}
+    def _canonical_prompt_input(
+        self,
+        *,
+        project_info: Dict[str, Any],
+        chapter_info: Dict[str, Any],
+        characters: List[Dict[str, Any]],
+        cover_type: str,
+        user_prompt: str,
+        reference_image_path: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        提取会写入提示词的字段并规范化，作为缓存键的输入
 
-请根据以上信息，生成一个详细的封面描述，包括:
-1. 画面主体内容
-2. 背景和环境
-3. 色彩氛围
-4. 关键元素
-5. 构图建议
+        只保留 _build_cover_prompt 实际使用的字段，空白、全角/半角和大小写的差异
+        不会导致缓存未命中；前3个主要角色按名称排序，与传入顺序无关
+        """
+        project_info = project_info or {}
+        chapter_info = chapter_info or {}
+        return {
+            "cover_type": "project" if cover_type == "project" else "chapter",
+            "project_name": _normalize_text(project_info.get("name")),
+            "project_description": _normalize_text(project_info.get("description")),
+            "chapter_title": _normalize_text(chapter_info.get("title")),
+            "chapter_summary": _normalize_text(chapter_info.get("summary")),
+            "characters": sorted(
+                _normalize_text(char["name"]) for char in islice(characters or (), 3)
+            ),
+            "user_prompt": _normalize_text(user_prompt),
+            "reference_image": bool(reference_image_path)
+        }
 
-请用中文回答，描述要生动具体，适合AI图像生成。
-"""
+    def _similar_cache_input(
+        self,
+        *,
+        project_info: Dict[str, Any],
+        chapter_info: Dict[str, Any],
+        characters: List[Dict[str, Any]],
+        cover_type: str,
+        user_prompt: str,
+        reference_image_path: Optional[str]
+    ) -> Tuple[Tuple[Any, ...], str]:
+        """构建近似缓存的分桶键（须完全一致的字段）与用于相似度比较的文本"""
+        project_info = project_info or {}
+        chapter_info = chapter_info or {}
+        character_names = ",".join(_normalize_text(char.get("name")) for char in characters or [])
+
+        bucket = (
+            _normalize_text(project_info.get("name")),
+            cover_type,
+            _normalize_text(chapter_info.get("title")),
+            bool(reference_image_path),
+            # 用户要求通常远短于项目描述和章节概要，参与相似度计算时其差异会被稀释，
+            # 因此必须精确一致（忽略空白、全角/半角和大小写）
+            _normalize_text(user_prompt)
+        )
+        # 字段可能存在但为None，统一规范化为字符串后再拼接
+        text = "|".join((
+            _normalize_text(project_info.get("description")),
+            _normalize_text(chapter_info.get("summary")),
+            character_names
+        ))
+        return bucket, text
+
+    def _build_cover_prompt(
+        self,
+        *,
+        project_info: Dict[str, Any],
+        chapter_info: Dict[str, Any],
+        characters: List[Dict[str, Any]],
+        cover_type: str,
+        user_prompt: str,
+        reference_image_path: Optional[str]
+    ) -> str:
+        """
+        构建AI提示
 
-        return full_prompt
+        Returns:
+            用户提示词（系统提示词为与本次请求无关的固定前缀）
+        """
+        return _render_cover_prompt(
+            project_info, chapter_info, characters, cover_type, user_prompt, reference_image_path
+        )
 
     def _parse_ai_response(self, response: str) -> Optional[Dict[str, Any]]:
         """
         解析AI响应
         """
-        try:
-            # 尝试解析JSON响应
-            if response.strip().startswith('{'):
-                return json.loads(response)
-
-            # 如果不是JSON，尝试提取描述文本
-            lines = response.strip().split('\n')
-            description = ""
-
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('1.') and not line.startswith('2.') and not line.startswith('3.') and not line.startswith('4.') and not line.startswith('5.'):
-                    description += line + " "
-
-            if description:
-                return {"cover_description": description.strip()}
-
-            return None
-
-        except Exception as e:
-            logger.error(f"解析AI响应失败: {e}")
-            return None
+        return _parse_cover_response(response)
 
     def _get_default_description(
         self,
@@ -232,4 +699,8 @@ class CoverGenerator:
             return f"精美的{project_name}封面，展现故事的主要风格和氛围，色彩鲜明，构图均衡，适合作为作品代表"
         else:
             chapter_title = chapter_info.get("title", "章节")
-            return f"精美的{chapter_title}封面，展现章节的主要情节和氛围，画面生动，引人入胜"
\ No newline at end of file
+            return f"精美的{chapter_title}封面，展现章节的主要情节和氛围，画面生动，引人入胜"
+
+
+# 创建单例实例（缓存和进行中的请求在所有调用之间共享）
+cover_generator = CoverGenerator()
@@ -4,11 +4,25 @@ Image Generator Agent
 
 负责根据漫画脚本中的描述生成和编辑图像。
 """
+import asyncio
+import json
 import logging
 import os
-from typing import Dict, Any, List
-
+import re
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, Any, List, Optional, Tuple
+
+from config import settings
 from services.ai_service import volc_service
+from services.file_system import ProjectFileSystem
+from utils.image_utils import download_image_from_url
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +30,162 @@ logger = logging.getLogger(__name__)
 GENERATION_MODEL = "doubao-seedream-4-0-250828"
 EDIT_MODEL = "doubao-seedream-4-0-250828"
 
+# 无参考图时第一张之后的备选图依次追加的简单变体
+_SIMPLE_VARIATIONS = (
+    ", 不同角度视角",
+    ", 构图调整",
+    ", 细节变化",
+    ", 表情变化",
+    ", 光影变化"
+)
+
+# 备用方案中失败备选图的最大并发重试轮数（含第一轮）
+_FALLBACK_MAX_ROUNDS = 3
+
+# 角色目录中作为参考图片读取的文件扩展名（小写）
+_REFERENCE_IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg'})
+
+# 角色参考信息缓存的最大条目数
+_CHARACTER_REFERENCE_CACHE_SIZE = 64
+
+# 前情提要图片下载缓存的最大条目数
+_REFERENCE_DOWNLOAD_CACHE_SIZE = 32
+
+# prompt中强制要求的标记，变体prompt据此判断基础prompt是否带有参考图约束
+_FORCE_TAG = "**强制要求** "
+
+# 有前情提要参考图时的保守变体策略，主要调整构图细节（每组对应一种策略）
+_CONSERVATIVE_VARIATIONS = (
+    # 构图微调（保持风格一致）
+    ("构图微调: 略微调整画面布局", "构图微调: 优化人物位置", "构图微调: 调整视角角度"),
+    # 细节丰富（保持风格一致）
+    ("细节丰富: 增加背景层次", "细节丰富: 优化服装纹理", "细节丰富: 增强表情细节"),
+    # 焦点变化（保持风格一致）
+    ("焦点调整: 突出人物表情", "焦点调整: 强调动作细节", "焦点调整: 平衡前景背景"),
+    # 情感表达（保持风格一致）
+    ("情感表达: 丰富面部表情", "情感表达: 优化姿态语言", "情感表达: 增强眼神交流")
+)
+
+# 没有前情提要时的适度变体策略
+_MODERATE_VARIATIONS = (
+    # 温和的视角变化
+    ("视角: 标准视角", "视角: 略微仰视", "视角: 略微俯视"),
+    # 光照微调
+    ("光照: 自然光效", "光照: 柔和光效", "光照: 明亮光效"),
+    # 构图调整
+    ("构图: 居中构图", "构图: 三分法构图", "构图: 稳定构图"),
+    # 细节侧重
+    ("细节: 人物清晰", "细节: 环境丰富", "细节: 表情生动")
+)
+
+# 创建变体prompt失败时使用的安全变化（有参考图 / 无参考图）
+_SAFE_REFERENCE_VARIATIONS = ("构图微调", "细节优化", "表情调整", "姿态优化")
+_SAFE_VARIATIONS = ("不同角度", "细节变化", "构图调整", "表情变化")
+
+# 有前情提要参考图时，变体prompt中强调风格一致性的前缀和附加要求
+_VARIANT_CONSISTENCY_PREFIX = "**保持风格一致** "
+_VARIANT_STYLE_CONSISTENCY = "**再次强调** 严格保持与前面画面的艺术风格、角色外观、色彩完全一致"
+
+# 提取分段文本中的对话：中文对话格式 "..." 或 「...」，以及英文对话格式 "..." 或 '...'
+_DIALOGUE_QUOTE_PATTERN = re.compile(r'["""](.*?)["""]')
+_DIALOGUE_BRACKET_PATTERN = re.compile(r'[「『](.*?)[」』]')
+_DIALOGUE_ENGLISH_QUOTE_PATTERN = re.compile(r'["\']([^"\']+)["\']')
+
+# 有结构化数据时追加在prompt末尾的基础风格和构图要求（有前情提要参考图 / 无参考图）
+_REFERENCE_STYLE_SUFFIX = ", ".join((
+    "**强制要求** 严格保持与参考图的角色外观、服装、发型、面部特征完全一致",
+    "**强制要求** 保持完全相同的绘画风格、线条粗细、色彩饱和度和色调",
+    "**强制要求** 保持相似的背景渲染风格和光影处理方式",
+    "**强制要求** 保持相同的角色比例和身材特征",
+    "漫画风格, 清晰线条, 精美构图, 统一艺术风格",
+    "高质量渲染, 保持系列连贯性"
+))
+_DEFAULT_STYLE_SUFFIX = ", ".join((
+    "漫画风格, 清晰线条, 精美构图, 统一艺术风格",
+    "高质量渲染, 注意角色一致性"
+))
+
+
+def _stat_regular_file(path: str) -> Optional[os.stat_result]:
+    """
+    获取普通文件的状态信息（一次 stat 同时判断存在性、文件类型和大小）
+
+    Returns:
+        路径是普通文件时返回 os.stat_result，否则返回 None
+    """
+    try:
+        file_stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return file_stat if stat.S_ISREG(file_stat.st_mode) else None
+
+
+def _stat_fingerprint(paths: Tuple[str, ...]) -> Tuple[Optional[Tuple[int, int]], ...]:
+    """
+    获取一组路径的修改时间和大小，用于判断缓存的文件内容是否已变化
+
+    Returns:
+        与paths一一对应的 (st_mtime_ns, st_size)，路径不存在时为 None
+    """
+    fingerprint = []
+    for path in paths:
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            fingerprint.append(None)
+        else:
+            fingerprint.append((path_stat.st_mtime_ns, path_stat.st_size))
+    return tuple(fingerprint)
+
+
+def _append_prompt_parts(parts: List[str], *fragments: str):
+    """依次追加独立的prompt片段，每个片段后跟片段分隔符 ", " """
+    for fragment in fragments:
+        parts.append(fragment)
+        parts.append(", ")
+
+
+def _append_prompt_section(parts: List[str], label: str, items: List[str]):
+    """追加 "标签: 条目1; 条目2" 形式的prompt片段，条目直接写入列表，不单独拼接"""
+    parts.append(label)
+    for index, item in enumerate(items):
+        if index:
+            parts.append("; ")
+        parts.append(item)
+    parts.append(", ")
+
+
+@lru_cache(maxsize=512)
+def _extract_dialogues(text: str) -> Tuple[str, ...]:
+    """
+    从文本中提取最多3处去重后的对话（结果不可变，可安全缓存）
+
+    Args:
+        text: 输入的文本内容
+
+    Returns:
+        提取的对话元组
+    """
+    # 依次提取引号对话、括号对话和英文对话，按需逐个匹配
+    dialogues = chain(
+        (f"\"{match.group(1)}\"" for match in _DIALOGUE_QUOTE_PATTERN.finditer(text)),
+        (f"「{match.group(1)}」" for match in _DIALOGUE_BRACKET_PATTERN.finditer(text)),
+        (f"\"{match.group(1)}\"" for match in _DIALOGUE_ENGLISH_QUOTE_PATTERN.finditer(text))
+    )
+
+    # 去重并过滤过短的对话，最多保留3处对话，避免prompt过长；凑够后不再继续匹配
+    unique_dialogues = []
+    seen = set()
+    for dialogue in dialogues:
+        if len(dialogue.strip()) > 3 and dialogue not in seen:
+            seen.add(dialogue)
+            unique_dialogues.append(dialogue)
+            if len(unique_dialogues) == 3:
+                break
+
+    return tuple(unique_dialogues)
+
+
 class ImageGenerator:
     """
     根据漫画脚本中的描述生成和编辑图像。
@@ -23,7 +193,35 @@ class ImageGenerator:
     """
 
     def __init__(self):
-        pass
+        # 项目路径 -> 当前章节目录名称，避免每张图片都重新读取章节状态文件
+        self._chapter_cache: Dict[str, str] = {}
+        # 章节解析在工作线程中执行，可重入（降级路径会再次进入章节解析）
+        self._chapter_lock = threading.RLock()
+        # 解析前情提要相对路径时使用的工作目录（服务进程运行期间不会切换目录）
+        self._cwd = os.getcwd()
+        # 限制整个进程同时进行的图像生成API调用数，多个分镜请求并发时共享，避免触发限流
+        self._image_call_semaphore = asyncio.Semaphore(max(1, settings.VOLCENGINE_MAX_CONCURRENCY))
+        # 前情提要图片URL -> 已下载的临时文件路径，相邻分镜引用同一张图片时不再重复下载；
+        # 按LRU淘汰，只在事件循环线程中访问
+        self._reference_downloads: OrderedDict = OrderedDict()
+        # (项目路径, 排序后的角色名) -> (依赖文件路径, 文件指纹, 角色参考信息)，
+        # 同一章节的各个分镜选择相同角色时不再重复扫描目录和解析角色卡
+        self._character_reference_cache: OrderedDict = OrderedDict()
+        # 角色参考信息在工作线程中读取，多个分镜并发时用锁保护缓存
+        self._character_reference_lock = threading.Lock()
+
+    def invalidate_chapter_cache(self, project_path: str = None):
+        """
+        清除缓存的当前章节（创建或切换章节后调用）
+
+        Args:
+            project_path: 项目路径，为None时清除所有项目的缓存
+        """
+        with self._chapter_lock:
+            if project_path is None:
+                self._chapter_cache.clear()
+            else:
+                self._chapter_cache.pop(project_path, None)
 
     def _get_next_chapter_number(self, project_path: str) -> int:
         """
@@ -40,22 +238,21 @@ class ImageGenerator:
             if not os.path.exists(chapters_dir):
                 return 1
 
-            # 扫描现有章节目录
-            existing_chapters = []
-            for item in os.listdir(chapters_dir):
-                if item.startswith("chapter_") and os.path.isdir(os.path.join(chapters_dir, item)):
-                    try:
-                        # 提取章节编号
-                        chapter_num = int(item.split("_")[1])
-                        existing_chapters.append(chapter_num)
-                    except (ValueError, IndexError):
-                        continue
-
-            if not existing_chapters:
-                return 1
+            # 扫描现有章节目录（scandir 的目录项自带类型信息，无需逐项 stat）
+            max_chapter = 0
+            with os.scandir(chapters_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith("chapter_") and entry.is_dir():
+                        try:
+                            # 提取章节编号
+                            chapter_num = int(entry.name.split("_")[1])
+                        except (ValueError, IndexError):
+                            continue
+                        if chapter_num > max_chapter:
+                            max_chapter = chapter_num
 
-            # 返回下一个章节编号
-            return max(existing_chapters) + 1
+            # 返回下一个章节编号（没有章节时为1）
+            return max_chapter + 1
 
         except Exception as e:
             logger.error(f"获取下一个章节编号失败: {e}")
@@ -73,41 +270,52 @@ class ImageGenerator:
         Returns:
             章节目录名称（如 "chapter_001"）
         """
-        try:
-            # 章节状态文件路径
-            chapter_state_file = os.path.join(project_path, "chapters", ".current_chapter.txt")
+        # 检查缓存、读取状态文件、创建章节目录和写入状态必须作为一个整体执行，
+        # 否则多个分镜在工作线程中并发解析时可能各自创建新章节
+        with self._chapter_lock:
+            try:
+                chapters_dir = os.path.join(project_path, "chapters")
 
-            # 确保chapters目录存在
-            chapters_dir = os.path.join(project_path, "chapters")
-            os.makedirs(chapters_dir, exist_ok=True)
+                # 优先使用缓存的当前章节（章节目录仍存在时）
+                cached_chapter = self._chapter_cache.get(project_path)
+                if cached_chapter and os.path.isdir(os.path.join(chapters_dir, cached_chapter)):
+                    return cached_chapter
 
-            # 如果存在章节状态文件，读取当前章节
-            if os.path.exists(chapter_state_file):
-                with open(chapter_state_file, 'r', encoding='utf-8') as f:
-                    current_chapter = f.read().strip()
-                    if current_chapter and os.path.exists(os.path.join(chapters_dir, current_chapter)):
-                        logger.info(f"📖 使用现有章节: {current_chapter}")
-                        return current_chapter
+                # 章节状态文件路径
+                chapter_state_file = os.path.join(chapters_dir, ".current_chapter.txt")
 
-            # 创建新章节
-            chapter_number = self._get_next_chapter_number(project_path)
-            chapter_dir = f"chapter_{chapter_number:03d}"
+                # 确保chapters目录存在
+                os.makedirs(chapters_dir, exist_ok=True)
 
-            # 创建章节目录
-            new_chapter_path = os.path.join(chapters_dir, chapter_dir)
-            os.makedirs(new_chapter_path, exist_ok=True)
+                # 如果存在章节状态文件，读取当前章节
+                if os.path.exists(chapter_state_file):
+                    with open(chapter_state_file, 'r', encoding='utf-8') as f:
+                        current_chapter = f.read().strip()
+                        if current_chapter and os.path.exists(os.path.join(chapters_dir, current_chapter)):
+                            logger.info(f"📖 使用现有章节: {current_chapter}")
+                            self._chapter_cache[project_path] = current_chapter
+                            return current_chapter
 
-            # 保存章节状态
-            with open(chapter_state_file, 'w', encoding='utf-8') as f:
-                f.write(chapter_dir)
+                # 创建新章节
+                chapter_number = self._get_next_chapter_number(project_path)
+                chapter_dir = f"chapter_{chapter_number:03d}"
 
-            logger.info(f"🆕 创建新章节: {chapter_dir}")
-            return chapter_dir
+                # 创建章节目录
+                new_chapter_path = os.path.join(chapters_dir, chapter_dir)
+                os.makedirs(new_chapter_path, exist_ok=True)
 
-        except Exception as e:
-            logger.error(f"获取或创建当前章节失败: {e}")
-            # 降级到原有的章节创建逻辑
-            return self._get_chapter_dir_name(project_path)
+                # 保存章节状态
+                with open(chapter_state_file, 'w', encoding='utf-8') as f:
+                    f.write(chapter_dir)
+
+                logger.info(f"🆕 创建新章节: {chapter_dir}")
+                self._chapter_cache[project_path] = chapter_dir
+                return chapter_dir
+
+            except Exception as e:
+                logger.error(f"获取或创建当前章节失败: {e}")
+                # 降级到原有的章节创建逻辑
+                return self._get_chapter_dir_name(project_path)
 
     def _get_chapter_dir_name(self, project_path: str, chapter_number: int = None, force_new_chapter: bool = False) -> str:
         """
@@ -130,6 +338,22 @@ class ImageGenerator:
             # 默认行为：复用现有章节
             return self._get_or_create_current_chapter(project_path)
 
+    def _prepare_segment_output_dir(self, project_path: str, segment_index: int) -> str:
+        """
+        获取并创建分镜图片的输出目录（chapters/章节/images/segment_XX）
+
+        Args:
+            project_path: 项目路径
+            segment_index: 段落索引
+
+        Returns:
+            输出目录路径
+        """
+        chapter_dir = self._get_chapter_dir_name(project_path)
+        output_dir = os.path.join(project_path, "chapters", chapter_dir, "images", f"segment_{segment_index + 1:02d}")
+        os.makedirs(output_dir, exist_ok=True)
+        return output_dir
+
     def _get_character_references(self, project_path: str, selected_characters: List[str]) -> Dict[str, Any]:
         """
         获取选定角色的参考图片和角色卡信息
@@ -139,27 +363,36 @@ class ImageGenerator:
             selected_characters: 选定的角色名称列表
 
         Returns:
-            包含角色参考信息的字典
+            包含角色参考信息的字典（与缓存共享，调用方不应修改）
         """
-        try:
-            from services.file_system import ProjectFileSystem
-            import json
-            import os
+        if not selected_characters:
+            return {}
+
+        cache_key = (project_path, tuple(sorted(set(selected_characters))))
+        with self._character_reference_lock:
+            cached = self._character_reference_cache.get(cache_key)
+        if cached is not None:
+            watched_paths, fingerprint, character_info = cached
+            # 角色列表、角色目录和角色卡都未变化时直接复用上次读取的结果
+            if _stat_fingerprint(watched_paths) == fingerprint:
+                with self._character_reference_lock:
+                    if cache_key in self._character_reference_cache:
+                        self._character_reference_cache.move_to_end(cache_key)
+                return character_info
 
+        try:
             fs = ProjectFileSystem()
             character_info = {}
+            # 读取结果所依赖的文件和目录，任一变化时缓存失效
+            watched_paths = [os.path.join(project_path, "characters", "characters.json")]
 
-            # 获取项目角色列表 - 使用正确的方法
-            try:
-                # 使用正确的方法名
-                characters = fs.get_project_characters(project_id)
-            except AttributeError:
-                # 如果方法不存在，使用备用方案
-                logger.warning(f"get_project_characters方法不存在，跳过角色参考信息获取")
-                characters = []
+            # 获取项目角色列表（characters/characters.json）
+            characters = fs.load_characters(project_path)
 
+            # 转为集合，每个角色的成员判断为O(1)
+            selected_names = set(selected_characters)
             for character in characters:
-                if character.get("name") in selected_characters:
+                if character.get("name") in selected_names:
                     char_name = character["name"]
                     char_data = {
                         "name": char_name,
@@ -170,20 +403,39 @@ class ImageGenerator:
 
                     # 获取角色参考图片路径
                     char_dir = f"{project_path}/characters/{char_name}"
+                    watched_paths.append(char_dir)
                     if os.path.exists(char_dir):
-                        # 查找角色卡JSON文件
-                        json_files = [f for f in os.listdir(char_dir) if f.endswith('.json')]
+                        # 一次扫描角色目录，同时找出角色卡JSON文件和角色正反面参考图片
+                        json_files = []
+                        image_files = []
+                        with os.scandir(char_dir) as entries:
+                            for entry in entries:
+                                if not entry.is_file():
+                                    continue
+                                extension = os.path.splitext(entry.name)[1]
+                                if extension == '.json':
+                                    json_files.append(entry.path)
+                                elif extension.lower() in _REFERENCE_IMAGE_EXTENSIONS:
+                                    image_files.append(entry.path)
+
                         if json_files:
-                            json_path = os.path.join(char_dir, json_files[0])
-                            with open(json_path, 'r', encoding='utf-8') as f:
+                            watched_paths.append(json_files[0])
+                            with open(json_files[0], 'r', encoding='utf-8') as f:
                                 char_data["character_card"] = json.load(f)
 
-                        # 查找角色正反面参考图片
-                        image_files = [f for f in os.listdir(char_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                        char_data["reference_image_paths"] = [os.path.join(char_dir, img) for img in image_files]
+                        char_data["reference_image_paths"] = image_files
 
                     character_info[char_name] = char_data
 
+            watched_paths = tuple(watched_paths)
+            fingerprint = _stat_fingerprint(watched_paths)
+            with self._character_reference_lock:
+                # 直接覆盖过期的条目
+                self._character_reference_cache[cache_key] = (watched_paths, fingerprint, character_info)
+                self._character_reference_cache.move_to_end(cache_key)
+                if len(self._character_reference_cache) > _CHARACTER_REFERENCE_CACHE_SIZE:
+                    self._character_reference_cache.popitem(last=False)
+
             return character_info
 
         except Exception as e:
@@ -217,78 +469,35 @@ class ImageGenerator:
         logger.info(f"🎨 开始为单个场景生成 {max_images} 张备选图像...")
 
         # 优化：预处理场景描述，确保简洁精准，控制在300字符以内
-        # 首先获取前情提要图片路径
+        # 首先获取前情提要图片路径（可能需要下载），在后台进行
         previous_context = script.get("previous_context", "")
-        reference_image_path = None
+        reference_task = None
         if previous_context:
-            import os
-
-            # 处理项目相对路径 (如 /projects/2025.10.25_11.48_勇者斗恶龙/...)
-            image_path = None
-            logger.info(f"开始处理前情提要图片路径: {previous_context}")
+            reference_task = asyncio.create_task(self._resolve_reference_image(previous_context))
 
-            if previous_context.startswith("/projects/"):
-                # 将项目相对路径转换为绝对路径
-                # 格式: /projects/项目名/子路径 -> 当前工作目录/projects/项目名/子路径
-                relative_path = previous_context[1:]  # 去掉开头的 /
-                image_path = os.path.join(os.getcwd(), relative_path)
-                logger.info(f"转换项目相对路径: {previous_context} -> {image_path}")
-            elif previous_context.startswith("http"):
-                # HTTP/HTTPS URL - 需要下载到本地
-                try:
-                    from utils.image_utils import download_image_from_url
-                    import tempfile
-                    import uuid
-
-                    # 创建临时文件
-                    temp_filename = f"reference_{uuid.uuid4().hex[:8]}.png"
-                    temp_dir = tempfile.gettempdir()
-                    temp_path = os.path.join(temp_dir, temp_filename)
-
-                    # 下载图片
-                    logger.info(f"下载前情提要图片到本地: {previous_context}")
-                    downloaded_path = await download_image_from_url(previous_context, temp_path)
-                    if downloaded_path and os.path.isfile(downloaded_path):
-                        image_path = downloaded_path
-                        logger.info(f"前情提要图片下载成功: {image_path}")
-                    else:
-                        logger.warning(f"前情提要图片下载失败: {previous_context}")
-                except Exception as e:
-                    logger.error(f"下载前情提要图片时出错: {e}")
-                    image_path = None
-            elif os.path.isfile(previous_context):
-                # 直接是文件系统路径
-                image_path = previous_context
-                logger.info(f"使用直接文件路径: {image_path}")
-            else:
-                # 尝试作为相对路径处理
-                possible_path = os.path.join(os.getcwd(), previous_context)
-                if os.path.isfile(possible_path):
-                    image_path = possible_path
-                    logger.info(f"作为相对路径解析成功: {previous_context} -> {image_path}")
-
-            # 验证图片文件是否存在且可读
-            if image_path and os.path.isfile(image_path):
-                # 检查文件大小，确保不是空文件
-                file_size = os.path.getsize(image_path)
-                if file_size > 0:
-                    reference_image_path = image_path  # 使用绝对路径
-                    logger.info(f"✅ 检测到有效的前情提要图片: {reference_image_path} (大小: {file_size} bytes)")
-                else:
-                    logger.warning(f"前情提要图片文件为空: {image_path}")
-            else:
-                logger.warning(f"❌ 前情提要图片路径无效或文件不存在: {previous_context}")
-                # 列出可能的调试信息
-                if previous_context.startswith("/projects/"):
-                    project_part = previous_context.split("/")[2] if len(previous_context.split("/")) > 2 else ""
-                    if project_part:
-                        projects_dir = os.path.join(os.getcwd(), "projects")
-                        if os.path.exists(projects_dir):
-                            logger.info(f"projects目录存在: {projects_dir}")
-                            project_dir = os.path.join(projects_dir, project_part)
-                            logger.info(f"项目目录检查: {project_dir}, 存在: {os.path.exists(project_dir)}")
-
-        optimized_prompt = self._optimize_scene_description(scene_description, script, project_path, reference_image_path)
+        # 等待前情提要图片的同时读取角色参考信息（文件读取放到线程中执行）
+        character_references = None
+        selected_characters = script.get("characters", [])
+        if selected_characters and project_path:
+            try:
+                character_references = await asyncio.to_thread(
+                    self._get_character_references, project_path, selected_characters
+                )
+            except Exception as e:
+                logger.warning(f"获取角色参考信息失败: {e}")
+                character_references = {}
+            except BaseException:
+                # 请求被取消时一并取消后台的前情提要图片任务
+                if reference_task:
+                    reference_task.cancel()
+                raise
+
+        reference_image_path = await reference_task if reference_task else None
+
+        optimized_prompt = self._optimize_scene_description(
+            scene_description, script, project_path, reference_image_path,
+            character_references=character_references
+        )
 
         logger.info(f"生成场景图像，优化后prompt长度: {len(optimized_prompt)} 字符")
 
@@ -296,77 +505,53 @@ class ImageGenerator:
         valid_image_urls = []
 
         try:
-            # 根据是否有参考图片选择不同的生成策略
+            # 根据是否有参考图片选择不同的生成策略；各张图片的API调用相互独立，
+            # 在线程中并发执行（同步SDK调用不阻塞事件循环），并发数受进程级信号量限制以避免触发限流
+            semaphore = self._image_call_semaphore
+
             if reference_image_path:
                 # 使用图片参考API进行图生图
                 logger.info(f"使用前情提要图片参考生成连贯性画面: {reference_image_path}")
 
-                # 对于有参考图片的情况，一次生成一张，然后生成变体
-                image_urls = []
-
-                for i in range(max_images):
-                    if i == 0:
-                        # 第一张图片使用参考图生成
-                        result_url = volc_service.multi_reference_text_to_image(
-                            model=GENERATION_MODEL,
-                            prompt=optimized_prompt,
-                            reference_images=[reference_image_path],
-                            max_images=1
-                        )
-                    else:
+                # 对于有参考图片的情况，第一张使用参考图生成，其余生成变体
+                async def generate_one(i: int):
+                    async with semaphore:
+                        if i == 0:
+                            # 第一张图片使用参考图生成
+                            return await asyncio.to_thread(
+                                volc_service.multi_reference_text_to_image,
+                                model=GENERATION_MODEL,
+                                prompt=optimized_prompt,
+                                reference_images=[reference_image_path],
+                                max_images=1
+                            )
                         # 后续图片使用变体prompt生成
                         variant_prompt = self._create_variant_prompt(optimized_prompt, i, max_images)
-                        result_url = volc_service.text_to_image(
+                        return await asyncio.to_thread(
+                            volc_service.text_to_image,
                             model=GENERATION_MODEL,
                             prompt=variant_prompt,
                             max_images=1,
                             stream=False
                         )
 
-                    if result_url:
-                        if isinstance(result_url, list):
-                            result_url = result_url[0] if result_url else None
-                        # 处理API返回的字典格式
-                        if isinstance(result_url, dict):
-                            result_url = result_url.get('image_url')
-                        image_urls.append(result_url)
-                    else:
-                        logger.warning(f"第{i+1}张图片生成失败，返回空URL")
-                        image_urls.append(None)
-
-                logger.info(f"使用图片参考生成了 {len([url for url in image_urls if url])} 张有效图像")
-
             else:
                 # 使用多次调用来模拟组图生成（无参考图片）
-                image_urls = []
-
                 logger.info(f"开始通过多次调用生成 {max_images} 张备选图像...")
 
-                # 获取结构化数据，用于变体prompt生成
-                structured_data = script.get("structured_data")
-                style_requirements = script.get("style_requirements", "")
-                style_reference_info = script.get("style_reference_info", "")
-
-                for i in range(max_images):
-                    try:
-                        # 为每个图像创建变体prompt
-                        if i > 0:
-                            # 第一张后的图像使用简单变体
-                            variations = [
-                                ", 不同角度视角",
-                                ", 构图调整",
-                                ", 细节变化",
-                                ", 表情变化",
-                                ", 光影变化"
-                            ]
-                            variation = variations[(i-1) % len(variations)]
-                            variant_prompt = optimized_prompt + variation
-                            logger.info(f"🎨 生成第 {i+1}/{max_images} 张图像，变体: {variation}")
-                        else:
-                            # 第一张图像使用原始prompt
-                            variant_prompt = optimized_prompt
-                            logger.info(f"🎨 生成第 {i+1}/{max_images} 张图像，原始prompt")
+                async def generate_one(i: int):
+                    # 为每个图像创建变体prompt
+                    if i > 0:
+                        # 第一张后的图像使用简单变体
+                        variation = _SIMPLE_VARIATIONS[(i-1) % len(_SIMPLE_VARIATIONS)]
+                        variant_prompt = optimized_prompt + variation
+                        logger.info(f"🎨 生成第 {i+1}/{max_images} 张图像，变体: {variation}")
+                    else:
+                        # 第一张图像使用原始prompt
+                        variant_prompt = optimized_prompt
+                        logger.info(f"🎨 生成第 {i+1}/{max_images} 张图像，原始prompt")
 
+                    async with semaphore:
                         # 单次调用生成一张图像
                         logger.info(f"🚀 开始调用火山引擎API - 第 {i+1}/{max_images} 张图像")
                         logger.info(f"📝 Prompt长度: {len(variant_prompt)} 字符")
@@ -374,10 +559,10 @@ class ImageGenerator:
 
                         try:
                             # 记录调用开始时间
-                            import time
                             start_time = time.time()
 
-                            image_url_result = volc_service.text_to_image(
+                            image_url_result = await asyncio.to_thread(
+                                volc_service.text_to_image,
                                 model=GENERATION_MODEL,
                                 prompt=variant_prompt,
                                 max_images=1,  # 每次只生成一张图片
@@ -386,8 +571,7 @@ class ImageGenerator:
                             )
 
                             # 记录调用结束时间
-                            end_time = time.time()
-                            api_duration = end_time - start_time
+                            api_duration = time.time() - start_time
                             logger.info(f"⏱️ 火山引擎API调用耗时: {api_duration:.2f} 秒")
                             logger.info(f"📦 API返回结果类型: {type(image_url_result)}")
                             logger.info(f"📦 API返回结果: {image_url_result}")
@@ -397,28 +581,54 @@ class ImageGenerator:
                             logger.error(f"❌ API错误类型: {type(api_error)}")
                             raise api_error
 
-                        if image_url_result:
-                            # 处理API返回的字典格式
-                            if isinstance(image_url_result, dict):
-                                image_url_result = image_url_result.get('image_url')
-                            image_urls.append(image_url_result)
-                            logger.info(f"第 {i+1} 张图像生成成功")
-                        else:
-                            logger.warning(f"第 {i+1} 张图像生成失败，返回空URL")
-                            image_urls.append(None)
+                    return image_url_result
+
+            # 结果顺序与图片编号一致；单张失败不影响其他图片
+            results = await asyncio.gather(
+                *(generate_one(i) for i in range(max_images)),
+                return_exceptions=True
+            )
+
+            image_urls = []
+            for i, result_url in enumerate(results):
+                if isinstance(result_url, Exception):
+                    logger.error(f"生成第 {i+1} 张图像时发生错误: {result_url}")
+                    result_url = None
+                elif isinstance(result_url, list):
+                    result_url = result_url[0] if result_url else None
+                # 处理API返回的字典格式
+                if isinstance(result_url, dict):
+                    result_url = result_url.get('image_url')
+
+                if result_url:
+                    logger.info(f"第 {i+1} 张图像生成成功")
+                    image_urls.append(result_url)
+                else:
+                    logger.warning(f"第 {i+1} 张图像生成失败，返回空URL")
+                    image_urls.append(None)
 
-                    except Exception as e:
-                        logger.error(f"生成第 {i+1} 张图像时发生错误: {e}")
-                        image_urls.append(None)
+            # 处理生成的图片URL列表
+            valid_image_urls = [url for url in image_urls if url is not None]
 
-                # 处理生成的图片URL列表
-                valid_image_urls = [url for url in image_urls if url is not None]
+            # 使用统一章节目录和分镜子目录（本场景所有备选图相同，只计算和创建一次）
+            output_dir = await asyncio.to_thread(self._prepare_segment_output_dir, project_path, segment_index)
 
             if len(valid_image_urls) > 0:
                 # 有有效图片，处理下载
                 logger.info(f"成功生成 {len(valid_image_urls)} 张备选图像")
                 generated_images = []
 
+                # 并发下载所有备选图（同一批图片共用一个毫秒时间戳，由备选图编号区分）
+                timestamp = time.time_ns() // 1_000_000
+                download_results = await asyncio.gather(
+                    *(
+                        download_image_from_url(image_url, os.path.join(output_dir, f"scene_option_{i+1}_{timestamp}.png"))
+                        for i, image_url in enumerate(image_urls) if image_url is not None
+                    ),
+                    return_exceptions=True
+                )
+                download_results = iter(download_results)
+
                 for i, image_url in enumerate(image_urls):
                     if image_url is None:
                         # 处理生成失败的图片
@@ -428,35 +638,25 @@ class ImageGenerator:
                             "error": "图片生成失败，返回空URL"
                         })
                         continue
-                    try:
-                        from utils.image_utils import download_image_from_url
-                        import time
-
-                        filename = f"scene_option_{i+1}_{int(time.time())}.png"
-                        # 使用统一章节目录和分镜子目录
-                        chapter_dir = self._get_chapter_dir_name(project_path)
-                        segment_dir = f"segment_{segment_index + 1:02d}"
-                        output_dir = f"{project_path}/chapters/{chapter_dir}/images/{segment_dir}"
-                        output_path = f"{output_dir}/{filename}"
-
-                        # 下载图像到本地
-                        local_path = await download_image_from_url(image_url, output_path)
-                        logger.info(f"备选图 {i+1} 已下载到本地: {local_path}")
 
-                        generated_images.append({
-                            "image_option": i + 1,  # 备选图编号
-                            "status": "success",
-                            "image_url": image_url,
-                            "local_path": local_path,
-                            "prompt_used": optimized_prompt
-                        })
-                    except Exception as e:
-                        logger.error(f"下载备选图 {i+1} 失败: {e}")
+                    local_path = next(download_results)
+                    if isinstance(local_path, Exception):
+                        logger.error(f"下载备选图 {i+1} 失败: {local_path}")
                         generated_images.append({
                             "image_option": i + 1,
                             "status": "download_failed",
-                            "error": str(e)
+                            "error": str(local_path)
                         })
+                        continue
+
+                    logger.info(f"备选图 {i+1} 已下载到本地: {local_path}")
+                    generated_images.append({
+                        "image_option": i + 1,  # 备选图编号
+                        "status": "success",
+                        "image_url": image_url,
+                        "local_path": local_path,
+                        "prompt_used": optimized_prompt
+                    })
 
                 return {
                     "scene_description": scene_description,
@@ -476,22 +676,23 @@ class ImageGenerator:
 
                 logger.warning(f"组图API只返回1张图片，启动备用方案生成 {max_images} 张不同图片")
 
-                generated_images = []
-                max_attempts = max_images * 2  # 增加最大尝试次数，确保能生成足够的图片
+                # 按编号记录每张备选图的结果，失败的编号在下一轮并发重试
+                slot_results: List[Optional[Dict[str, Any]]] = [None] * max_images
                 attempt_count = 0
 
-                # 生成多张不同的图片，带有重试机制
-                while len([img for img in generated_images if img["status"] == "success"]) < max_images and attempt_count < max_attempts:
-                    i = len([img for img in generated_images if img["status"] == "success"])
+                # 备用方案的图片编号在本次调用内不重复，共用一个毫秒时间戳即可保证文件名唯一
+                timestamp = time.time_ns() // 1_000_000
 
-                    try:
-                        attempt_count += 1
-                        logger.info(f"第 {attempt_count} 次尝试生成备选图 {i+1}/{max_images}")
+                async def generate_fallback(i: int, round_number: int) -> Optional[Dict[str, Any]]:
+                    async with semaphore:
+                        logger.info(f"第 {round_number} 轮尝试生成备选图 {i+1}/{max_images}")
 
                         if i == 0 and reference_image_path:
                             # 第一张图片使用参考图生成
                             logger.info(f"生成备选图 {i+1}/{max_images}，使用前情提要图片参考")
-                            variant_url = volc_service.multi_reference_text_to_image(
+                            prompt_used = optimized_prompt
+                            variant_url = await asyncio.to_thread(
+                                volc_service.multi_reference_text_to_image,
                                 model=GENERATION_MODEL,
                                 prompt=optimized_prompt,
                                 reference_images=[reference_image_path],
@@ -499,73 +700,80 @@ class ImageGenerator:
                             )
                         else:
                             # 为每张图片生成略有不同的prompt
-                            variant_prompt = self._create_variant_prompt(optimized_prompt, i, max_images)
+                            prompt_used = self._create_variant_prompt(optimized_prompt, i, max_images)
 
                             logger.info(f"生成备选图 {i+1}/{max_images}，使用变体prompt")
 
-                            variant_url = volc_service.text_to_image(
+                            variant_url = await asyncio.to_thread(
+                                volc_service.text_to_image,
                                 model=GENERATION_MODEL,
-                                prompt=variant_prompt,
+                                prompt=prompt_used,
                                 max_images=1,  # 每次只生成1张
                                 stream=False
                             )
 
-                        if isinstance(variant_url, list):
-                            variant_url = variant_url[0] if variant_url else None
-
-                        # 处理API返回的字典格式
-                        if isinstance(variant_url, dict):
-                            variant_url = variant_url.get('image_url')
-
-                        if variant_url:
-                            from utils.image_utils import download_image_from_url
-                            import time
-
-                            filename = f"scene_option_{i+1}_{int(time.time())}.png"
-                            # 使用统一章节目录和分镜子目录
-                            chapter_dir = self._get_chapter_dir_name(project_path)
-                            segment_dir = f"segment_{segment_index + 1:02d}"
-                            output_dir = f"{project_path}/chapters/{chapter_dir}/images/{segment_dir}"
-                            output_path = f"{output_dir}/{filename}"
-
-                            # 下载图像到本地
-                            local_path = await download_image_from_url(variant_url, output_path)
-                            logger.info(f"备选图 {i+1} 已下载到本地: {local_path}")
-
-                            generated_images.append({
-                                "image_option": i + 1,
-                                "status": "success",
-                                "image_url": variant_url,
-                                "local_path": local_path,
-                                "prompt_used": variant_prompt if 'variant_prompt' in locals() else optimized_prompt
-                            })
+                    if isinstance(variant_url, list):
+                        variant_url = variant_url[0] if variant_url else None
+
+                    # 处理API返回的字典格式
+                    if isinstance(variant_url, dict):
+                        variant_url = variant_url.get('image_url')
+
+                    if not variant_url:
+                        logger.error(f"备选图 {i+1} 生成失败，返回空URL (第 {round_number}/{_FALLBACK_MAX_ROUNDS} 轮)")
+                        return None
+
+                    # 下载图像到本地（下载不占用生成API的并发名额）
+                    output_path = os.path.join(output_dir, f"scene_option_{i+1}_{timestamp}.png")
+                    local_path = await download_image_from_url(variant_url, output_path)
+                    logger.info(f"备选图 {i+1} 已下载到本地: {local_path}")
+
+                    return {
+                        "image_option": i + 1,
+                        "status": "success",
+                        "image_url": variant_url,
+                        "local_path": local_path,
+                        "prompt_used": prompt_used
+                    }
+
+                # 第一轮并发生成全部备选图，之后只对失败的编号并发重试，最多进行固定轮数
+                pending_indices = list(range(max_images))
+                for round_number in range(1, _FALLBACK_MAX_ROUNDS + 1):
+                    attempt_count += len(pending_indices)
+
+                    results = await asyncio.gather(
+                        *(generate_fallback(i, round_number) for i in pending_indices),
+                        return_exceptions=True
+                    )
+
+                    failed_indices = []
+                    retry_delay_needed = False
+                    for i, result in zip(pending_indices, results):
+                        if isinstance(result, Exception):
+                            logger.error(f"备选图 {i+1} 生成失败 (第 {round_number}/{_FALLBACK_MAX_ROUNDS} 轮): {result}")
+                            # 如果是网络或API错误，等待一段时间再重试
+                            error_text = str(result).lower()
+                            if "network" in error_text or "connection" in error_text or "timeout" in error_text:
+                                retry_delay_needed = True
+                            result = None
+
+                        if result is None:
+                            failed_indices.append(i)
                         else:
-                            logger.error(f"备选图 {i+1} 生成失败，返回空URL (尝试 {attempt_count}/{max_attempts})")
-                            if attempt_count < max_attempts:  # 只有还有尝试机会时才添加失败记录
-                                generated_images.append({
-                                    "image_option": i + 1,
-                                    "status": "generation_failed",
-                                    "error": "Empty URL returned"
-                                })
-
-                    except Exception as e:
-                        logger.error(f"备选图 {i+1} 生成失败 (尝试 {attempt_count}/{max_attempts}): {e}")
-                        if attempt_count < max_attempts:  # 只有还有尝试机会时才添加失败记录
-                            generated_images.append({
-                                "image_option": i + 1,
-                                "status": "generation_failed",
-                                "error": str(e)
-                            })
-
-                        # 如果是网络或API错误，等待一段时间再重试
-                        if "network" in str(e).lower() or "connection" in str(e).lower() or "timeout" in str(e).lower():
-                            import asyncio
-                            await asyncio.sleep(2)  # 等待2秒后重试
-
-                # 过滤掉失败的记录，只保留成功的图片
-                successful_images = [img for img in generated_images if img["status"] == "success"]
-
-                # 如果成功图片数量不足，填充占位图片
+                            slot_results[i] = result
+
+                    pending_indices = failed_indices
+                    if not pending_indices:
+                        break
+
+                    if retry_delay_needed and round_number < _FALLBACK_MAX_ROUNDS:
+                        await asyncio.sleep(2)  # 等待2秒后统一重试失败的图片
+
+                # 成功的图片按顺序重新编号，数量不足时填充占位图片
+                successful_images = [entry for entry in slot_results if entry is not None]
+                for index, entry in enumerate(successful_images):
+                    entry["image_option"] = index + 1
+
                 while len(successful_images) < max_images:
                     placeholder_index = len(successful_images) + 1
                     logger.warning(f"无法生成足够的图片，使用占位图片 {placeholder_index}/{max_images}")
@@ -601,7 +809,143 @@ class ImageGenerator:
                 "generation_type": "failed"
             }
 
-    def _optimize_scene_description(self, description: str, script: Dict[str, Any], project_path: str = "", reference_image_path: str = "") -> str:
+    async def _resolve_reference_image(self, previous_context: str) -> Optional[str]:
+        """
+        解析前情提要图片路径
+
+        支持项目相对路径（/projects/...）、HTTP/HTTPS URL（下载到临时文件）、
+        文件系统路径和相对于当前工作目录的路径。本地路径的文件系统检查在线程中执行，
+        不阻塞事件循环
+
+        Args:
+            previous_context: 脚本中的前情提要
+
+        Returns:
+            有效（存在且非空）的图片绝对路径，无效时返回None
+        """
+        logger.info(f"开始处理前情提要图片路径: {previous_context}")
+
+        if previous_context.startswith("http"):
+            # HTTP/HTTPS URL - 异步下载，下载结果已带有文件状态，校验时无需再访问文件系统
+            image_path, image_stat = await self._download_reference_image(previous_context)
+            return self._resolve_reference_image_sync(previous_context, image_path, image_stat)
+
+        return await asyncio.to_thread(self._resolve_reference_image_sync, previous_context)
+
+    async def _download_reference_image(self, url: str) -> Tuple[Optional[str], Optional[os.stat_result]]:
+        """
+        下载前情提要图片到临时文件，同一URL复用之前下载的临时文件
+
+        Args:
+            url: 前情提要图片URL
+
+        Returns:
+            (本地文件路径, 文件状态)，下载失败时为 (None, None)
+        """
+        cached_path = self._reference_downloads.get(url)
+        if cached_path:
+            image_stat = _stat_regular_file(cached_path)
+            if image_stat:
+                self._reference_downloads.move_to_end(url)
+                logger.info(f"复用已下载的前情提要图片: {cached_path}")
+                return cached_path, image_stat
+            # 临时文件已被清理，重新下载
+            self._reference_downloads.pop(url, None)
+
+        try:
+            # 创建临时文件
+            temp_filename = f"reference_{uuid.uuid4().hex[:8]}.png"
+            temp_dir = tempfile.gettempdir()
+            temp_path = os.path.join(temp_dir, temp_filename)
+
+            # 下载图片
+            logger.info(f"下载前情提要图片到本地: {url}")
+            downloaded_path = await download_image_from_url(url, temp_path)
+            image_stat = _stat_regular_file(downloaded_path) if downloaded_path else None
+            if image_stat:
+                self._reference_downloads[url] = downloaded_path
+                if len(self._reference_downloads) > _REFERENCE_DOWNLOAD_CACHE_SIZE:
+                    self._reference_downloads.popitem(last=False)
+                logger.info(f"前情提要图片下载成功: {downloaded_path}")
+                return downloaded_path, image_stat
+            logger.warning(f"前情提要图片下载失败: {url}")
+        except Exception as e:
+            logger.error(f"下载前情提要图片时出错: {e}")
+        return None, None
+
+    def _resolve_reference_image_sync(
+        self,
+        previous_context: str,
+        image_path: Optional[str] = None,
+        image_stat: Optional[os.stat_result] = None
+    ) -> Optional[str]:
+        """
+        解析并校验本地前情提要图片路径（同步文件系统操作，由调用方决定是否放到线程中执行）
+
+        Args:
+            previous_context: 脚本中的前情提要
+            image_path: 已下载的图片路径（URL前情提要时由调用方传入）
+            image_stat: image_path 对应的文件状态
+
+        Returns:
+            有效（存在且非空）的图片绝对路径，无效时返回None
+        """
+        reference_image_path = None
+
+        if previous_context.startswith("/projects/"):
+            # 处理项目相对路径 (如 /projects/2025.10.25_11.48_勇者斗恶龙/...)
+            # 将项目相对路径转换为绝对路径
+            # 格式: /projects/项目名/子路径 -> 当前工作目录/projects/项目名/子路径
+            relative_path = previous_context[1:]  # 去掉开头的 /
+            image_path = os.path.join(self._cwd, relative_path)
+            logger.info(f"转换项目相对路径: {previous_context} -> {image_path}")
+        elif not previous_context.startswith("http"):
+            image_stat = _stat_regular_file(previous_context)
+            if image_stat:
+                # 直接是文件系统路径
+                image_path = previous_context
+                logger.info(f"使用直接文件路径: {image_path}")
+            else:
+                # 尝试作为相对路径处理
+                possible_path = os.path.join(self._cwd, previous_context)
+                image_stat = _stat_regular_file(possible_path)
+                if image_stat:
+                    image_path = possible_path
+                    logger.info(f"作为相对路径解析成功: {previous_context} -> {image_path}")
+
+        # 验证图片文件是否存在且可读（每个候选路径只 stat 一次）
+        if image_path and image_stat is None:
+            image_stat = _stat_regular_file(image_path)
+        if image_path and image_stat:
+            # 检查文件大小，确保不是空文件
+            file_size = image_stat.st_size
+            if file_size > 0:
+                reference_image_path = image_path  # 使用绝对路径
+                logger.info(f"✅ 检测到有效的前情提要图片: {reference_image_path} (大小: {file_size} bytes)")
+            else:
+                logger.warning(f"前情提要图片文件为空: {image_path}")
+        else:
+            logger.warning(f"❌ 前情提要图片路径无效或文件不存在: {previous_context}")
+            # 列出可能的调试信息
+            if previous_context.startswith("/projects/"):
+                project_part = previous_context.split("/")[2] if len(previous_context.split("/")) > 2 else ""
+                if project_part:
+                    projects_dir = os.path.join(self._cwd, "projects")
+                    if os.path.exists(projects_dir):
+                        logger.info(f"projects目录存在: {projects_dir}")
+                        project_dir = os.path.join(projects_dir, project_part)
+                        logger.info(f"项目目录检查: {project_dir}, 存在: {os.path.exists(project_dir)}")
+
+        return reference_image_path
+
+    def _optimize_scene_description(
+        self,
+        description: str,
+        script: Dict[str, Any],
+        project_path: str = "",
+        reference_image_path: str = "",
+        character_references: Optional[Dict[str, Any]] = None
+    ) -> str:
         """
         优化场景描述，使用清晰的数据优先级避免信息冲突
 
@@ -615,6 +959,8 @@ class ImageGenerator:
             description: 用户编辑的原始场景描述 (最高优先级)
             script: 包含结构化数据、角色选择等的脚本
             project_path: 项目路径，用于获取角色参考信息
+            reference_image_path: 调用方已解析并校验过的前情提要图片路径（没有时为空）
+            character_references: 调用方已读取的角色参考信息（为None时在这里读取）
 
         Returns:
             优化后的图像生成prompt
@@ -624,11 +970,9 @@ class ImageGenerator:
             structured_data = script.get("structured_data")
             selected_characters = script.get("characters", [])
             style_requirements = script.get("style_requirements", "")
-
-            # 获取角色参考信息
-            character_references = {}
-            if selected_characters and project_path:
-                character_references = self._get_character_references(project_path, selected_characters)
+            reference_images = script.get("reference_images", [])
+            previous_context = script.get("previous_context", "")
+            previous_segment_text = script.get("previous_segment_text", "")  # 新增：前情提要文本
 
             # 提取分段文本中的对话内容
             dialogue_requirements = []
@@ -640,39 +984,32 @@ class ImageGenerator:
                     dialogue_requirements.append(f"**强制要求** 画面中必须体现以下角色对话: {dialogue_text}")
                     logger.info(f"添加对话要求到prompt: {dialogue_text}")
 
+            # 快速路径：只有用户文本、没有任何附加信息时，直接得到与下面降级逻辑相同的结果，
+            # 跳过角色参考读取和各部分的拼装
+            if not (structured_data or selected_characters or style_requirements
+                    or reference_images or previous_context or previous_segment_text):
+                optimized_prompt = ", ".join([f"场景描述: {description}", *dialogue_requirements, "漫画风格, 清晰线条", "高质量渲染"])
+                logger.info(f"仅有用户文本，使用简单prompt，长度: {len(optimized_prompt)} 字符")
+                return optimized_prompt
+
+            # 获取角色参考信息
+            if character_references is None:
+                character_references = {}
+                if selected_characters and project_path:
+                    character_references = self._get_character_references(project_path, selected_characters)
+
             # 获取风格参考图片信息
-            reference_images = script.get("reference_images", [])
             style_reference_info = ""
             if reference_images and project_path:
                 style_reference_info = "参考上传的画风图片进行风格渲染"
 
             # 获取前情提要图片信息
-            previous_context = script.get("previous_context", "")
-            previous_segment_text = script.get("previous_segment_text", "")  # 新增：前情提要文本
             continuity_info = ""
-            reference_image_path = None
 
-            # 检查前情提要是否为图片路径
+            # 前情提要图片路径已由调用方解析和校验，这里不再重复访问文件系统
             if previous_context:
-                import os
-
-                # 处理项目相对路径 (如 /projects/2025.10.25_11.48_勇者斗恶龙/...)
-                image_path = None
-                if previous_context.startswith("/projects/"):
-                    # 将项目相对路径转换为绝对路径
-                    # 格式: /projects/项目名/子路径 -> 当前工作目录/projects/项目名/子路径
-                    relative_path = previous_context[1:]  # 去掉开头的 /
-                    image_path = os.path.join(os.getcwd(), relative_path)
-                    logger.info(f"转换项目相对路径: {previous_context} -> {image_path}")
-                elif os.path.isfile(previous_context):
-                    # 直接是文件系统路径
-                    image_path = previous_context
-
-                if image_path and os.path.isfile(image_path):
-                    # 前情提要是一个有效的图片文件路径
-                    reference_image_path = image_path  # 使用绝对路径
-
-                    # 构建包含前情提要文本的连贯性信息
+                if reference_image_path:
+                    # 前情提要是一个有效的图片文件路径，构建包含前情提要文本的连贯性信息
                     if previous_segment_text:
                         continuity_info = f"保持与前情提要的剧情连贯性：前情概述'{previous_segment_text[:150]}...'，严格参考上一段画面的风格、角色外观、表情动作和场景布局"
                         logger.info(f"检测到前情提要图片参考和文本: {reference_image_path} + 文本:{previous_segment_text[:50]}...")
@@ -693,27 +1030,34 @@ class ImageGenerator:
                     continuity_info = f"保持与前情提要的剧情连贯性：前情概述'{previous_segment_text[:150]}...'"
                     logger.info(f"仅前情提要文本（无图片）: {previous_segment_text[:50]}...")
 
-            # 初始化各个部分
-            core_scene = []      # 核心情节描述 (用户编辑的文本)
-            character_info = []  # 角色信息 (用户选择的角色)
-            scene_supplement = [] # 场景补充信息 (AI分析，仅当需要时)
-            visual_elements = [] # 视觉元素 (AI分析)
-            style_info = []      # 风格信息
-
             # 1. 核心情节描述 - 优先使用用户编辑的文本
+            core_scene = ""
             if description and description.strip():
                 # 用户编辑的文本作为核心内容
-                core_scene.append(description.strip())
+                core_scene = description.strip()
                 logger.info(f"使用用户编辑的文本作为核心情节: {len(description)} 字符")
             elif structured_data and "content" in structured_data:
                 # 只有在用户没有编辑文本时，才使用AI分析的内容
-                ai_content = structured_data["content"]
-                core_scene.append(ai_content)
-                logger.info(f"使用AI分析的内容作为核心情节: {len(ai_content)} 字符")
+                core_scene = structured_data["content"]
+                logger.info(f"使用AI分析的内容作为核心情节: {len(core_scene)} 字符")
+
+            # 以下各部分只在有结构化数据时使用，在对应分支中按需构建
+            character_info = []   # 角色信息 (用户选择的角色)
+            scene_supplement = [] # 场景补充信息 (AI分析，仅当需要时)
+
+            # 构建优化prompt - 按照优先级顺序，各部分直接追加到同一个列表
+            if structured_data:
+                # prompt片段和分隔符依次追加到同一个列表，最后只做一次join
+                optimized_parts = []
 
-            # 2. 角色信息 - 优先使用用户选择的角色
-            if selected_characters:
+                # 1. 核心情节描述 (最高优先级)
+                if core_scene:
+                    _append_prompt_parts(optimized_parts, f"核心情节: {core_scene}")
+
+                # 2. 角色信息 (高优先级) - 只使用前3条，凑够后不再处理其余角色
                 for char_name in selected_characters:
+                    if len(character_info) >= 3:
+                        break
                     if char_name in character_references:
                         char_ref = character_references[char_name]
                         # 添加角色名称和描述
@@ -739,14 +1083,18 @@ class ImageGenerator:
                         # 如果没有角色参考信息，至少添加角色名
                         character_info.append(char_name)
 
-            # 2.1. 使用text_segmenter提供的角色信息，无需额外优化
+                # 2.1. 使用text_segmenter提供的角色信息，无需额外优化
+                if character_info:
+                    _append_prompt_section(optimized_parts, "角色设定: ", character_info[:3])  # 限制数量避免过长
 
-            # 3. 场景补充信息 - 始终使用AI分析数据来增强一致性
-            if structured_data:
+                # 2.1. 对话要求 (高优先级，必须在画面中体现)
+                if dialogue_requirements:
+                    _append_prompt_parts(optimized_parts, *dialogue_requirements)  # 添加对话强制要求
+
+                # 3. 场景补充信息 (中等优先级) - 始终使用AI分析数据来增强一致性
                 # 使用AI分析的场景设定
                 if "scene_setting" in structured_data:
-                    scene_setting = structured_data["scene_setting"]
-                    scene_supplement.append(f"环境: {scene_setting}")
+                    scene_supplement.append(f"环境: {structured_data['scene_setting']}")
 
                 # 添加环境元素（增加数量）
                 if "scene_elements" in structured_data:
@@ -764,8 +1112,11 @@ class ImageGenerator:
                     else:
                         scene_supplement.append(f"事件: {key_events}")
 
-            # 4. 视觉元素和情感基调 - 从AI分析中提取（与用户输入不冲突）
-            if structured_data:
+                if scene_supplement:
+                    _append_prompt_section(optimized_parts, "场景环境: ", scene_supplement[:4])  # 增加到4个
+
+                # 4. 视觉元素和情感基调 (中等优先级) - 从AI分析中提取（与用户输入不冲突）
+                visual_elements = []
                 # 视觉关键词（增加数量）
                 if "visual_keywords" in structured_data:
                     visual_keywords = structured_data["visual_keywords"]
@@ -786,70 +1137,40 @@ class ImageGenerator:
                 if "character_descriptions" in structured_data:
                     char_descriptions = structured_data["character_descriptions"]
                     if isinstance(char_descriptions, dict):
-                        for char_name, description in list(char_descriptions.items())[:3]:  # 前3个角色描述
-                            visual_elements.append(f"{char_name}: {description}")
+                        for char_name, char_description in list(char_descriptions.items())[:3]:  # 前3个角色描述
+                            visual_elements.append(f"{char_name}: {char_description}")
 
-            # 5. 风格信息
-            if style_requirements:
-                style_info.append(style_requirements)
-            if style_reference_info:
-                style_info.append(style_reference_info)
-
-            # 构建优化prompt - 按照优先级顺序
-            if structured_data:
-                optimized_parts = []
-
-                # 1. 核心情节描述 (最高优先级)
-                if core_scene:
-                    optimized_parts.append(f"核心情节: {'; '.join(core_scene)}")
-
-                # 2. 角色信息 (高优先级)
-                if character_info:
-                    optimized_parts.append(f"角色设定: {'; '.join(character_info[:3])}")  # 限制数量避免过长
-
-                # 2.1. 对话要求 (高优先级，必须在画面中体现)
-                if dialogue_requirements:
-                    optimized_parts.extend(dialogue_requirements)  # 添加对话强制要求
-
-                # 3. 场景补充信息 (中等优先级，仅当需要时)
-                if scene_supplement:
-                    optimized_parts.append(f"场景环境: {'; '.join(scene_supplement[:4])}")  # 增加到4个
-
-                # 4. 视觉元素和情感 (中等优先级)
                 if visual_elements:
-                    optimized_parts.append(f"视觉风格: {'; '.join(visual_elements[:10])}")  # 增加到10个
+                    _append_prompt_section(optimized_parts, "视觉风格: ", visual_elements[:10])  # 增加到10个
 
                 # 5. 剧情连贯性 (前情提要)
                 if continuity_info:
                     if reference_image_path:
                         # 有图片参考时，连贯性信息优先级提高，并强调视觉一致性
-                        optimized_parts.append(f"视觉连贯性要求: {continuity_info}")
+                        _append_prompt_parts(optimized_parts, f"视觉连贯性要求: {continuity_info}")
                         logger.info("检测到图片参考，提升连贯性优先级")
                     else:
-                        optimized_parts.append(continuity_info)
+                        _append_prompt_parts(optimized_parts, continuity_info)
 
                 # 6. 风格要求 (用户指定)
-                if style_info:
-                    optimized_parts.append(f"艺术风格: {', '.join(style_info)}")
+                if style_requirements and style_reference_info:
+                    _append_prompt_parts(optimized_parts, f"艺术风格: {style_requirements}, {style_reference_info}")
+                elif style_requirements or style_reference_info:
+                    _append_prompt_parts(optimized_parts, f"艺术风格: {style_requirements or style_reference_info}")
+
+                # 6.1. 角色和场景约束 - 使用text_segmenter的分析结果
+                character_count_constraints = self._extract_character_count_constraints(core_scene, structured_data, character_info)
+                if character_count_constraints:
+                    _append_prompt_parts(optimized_parts, *character_count_constraints)
 
                 # 7. 基础风格和构图 (默认添加)
                 if reference_image_path:
                     # 有图片参考时，更强调与参考图的一致性
-                    optimized_parts.extend([
-                        "**强制要求** 严格保持与参考图的角色外观、服装、发型、面部特征完全一致",
-                        "**强制要求** 保持完全相同的绘画风格、线条粗细、色彩饱和度和色调",
-                        "**强制要求** 保持相似的背景渲染风格和光影处理方式",
-                        "**强制要求** 保持相同的角色比例和身材特征",
-                        "漫画风格, 清晰线条, 精美构图, 统一艺术风格",
-                        "高质量渲染, 保持系列连贯性"
-                    ])
+                    optimized_parts.append(_REFERENCE_STYLE_SUFFIX)
                 else:
-                    optimized_parts.extend([
-                        "漫画风格, 清晰线条, 精美构图, 统一艺术风格",
-                        "高质量渲染, 注意角色一致性"
-                    ])
+                    optimized_parts.append(_DEFAULT_STYLE_SUFFIX)
 
-                optimized_prompt = ", ".join(optimized_parts)
+                optimized_prompt = "".join(optimized_parts)
 
             else:
                 # 降级：没有结构化数据时的简单逻辑
@@ -887,24 +1208,12 @@ class ImageGenerator:
                 optimized_prompt = ", ".join(optimized_parts)
 
             # 记录最终prompt长度和使用的策略
-            logger.info(f"生成优化prompt，长度: {len(optimized_prompt)} 字符")
-            logger.info(f"数据使用策略 - 用户文本: {'是' if core_scene else '否'}, "
-                       f"选定角色: {len(selected_characters)}个, "
-                       f"结构化数据: {'是' if structured_data else '否'}, "
-                       f"场景补充: {'是' if scene_supplement else '否'}")
-
-            # 6. 添加角色和场景约束 - 使用text_segmenter的分析结果
-            character_count_constraints = self._extract_character_count_constraints(core_scene, structured_data, character_info)
-            if character_count_constraints:
-                # 添加约束到prompt中
-                optimized_parts.extend(character_count_constraints)
-
-            # 记录最终prompt长度和使用的策略
-            logger.info(f"生成优化prompt，长度: {len(optimized_prompt)} 字符")
-            logger.info(f"数据使用策略 - 用户文本: {'是' if core_scene else '否'}, "
-                       f"选定角色: {len(selected_characters)}个, "
-                       f"结构化数据: {'是' if structured_data else '否'}, "
-                       f"场景补充: {'是' if scene_supplement else '否'}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"生成优化prompt，长度: {len(optimized_prompt)} 字符")
+                logger.info(f"数据使用策略 - 用户文本: {'是' if core_scene else '否'}, "
+                           f"选定角色: {len(selected_characters)}个, "
+                           f"结构化数据: {'是' if structured_data else '否'}, "
+                           f"场景补充: {'是' if scene_supplement else '否'}")
 
             return optimized_prompt
 
@@ -927,56 +1236,32 @@ class ImageGenerator:
         """
         try:
             # 检查是否有前情提要参考图，如果有则优先保持风格一致性
-            has_reference = "**强制要求** " in base_prompt or "reference_image_path" in str(base_prompt)
+            has_reference = _FORCE_TAG in base_prompt
 
             if has_reference:
                 # 有前情提要时，使用更保守的变体策略，主要调整构图细节
-                conservative_variations = [
-                    # 构图微调（保持风格一致）
-                    ["构图微调: 略微调整画面布局", "构图微调: 优化人物位置", "构图微调: 调整视角角度"],
-                    # 细节丰富（保持风格一致）
-                    ["细节丰富: 增加背景层次", "细节丰富: 优化服装纹理", "细节丰富: 增强表情细节"],
-                    # 焦点变化（保持风格一致）
-                    ["焦点调整: 突出人物表情", "焦点调整: 强调动作细节", "焦点调整: 平衡前景背景"],
-                    # 情感表达（保持风格一致）
-                    ["情感表达: 丰富面部表情", "情感表达: 优化姿态语言", "情感表达: 增强眼神交流"]
-                ]
-
                 # 选择保守策略
-                strategy_index = variant_index % len(conservative_variations)
-                selected_strategy = conservative_variations[strategy_index]
+                strategy_index = variant_index % len(_CONSERVATIVE_VARIATIONS)
+                selected_strategy = _CONSERVATIVE_VARIATIONS[strategy_index]
                 variation_index_in_strategy = variant_index % len(selected_strategy)
                 variation = selected_strategy[variation_index_in_strategy]
 
                 # 为有参考图的变体添加风格一致性强调
-                consistency_prefix = "**保持风格一致** "
-                variation = f"{consistency_prefix} {variation}"
+                variation = f"{_VARIANT_CONSISTENCY_PREFIX} {variation}"
 
             else:
                 # 没有前情提要时，使用适度变化策略
-                moderate_variations = [
-                    # 温和的视角变化
-                    ["视角: 标准视角", "视角: 略微仰视", "视角: 略微俯视"],
-                    # 光照微调
-                    ["光照: 自然光效", "光照: 柔和光效", "光照: 明亮光效"],
-                    # 构图调整
-                    ["构图: 居中构图", "构图: 三分法构图", "构图: 稳定构图"],
-                    # 细节侧重
-                    ["细节: 人物清晰", "细节: 环境丰富", "细节: 表情生动"]
-                ]
-
-                strategy_index = variant_index % len(moderate_variations)
-                selected_strategy = moderate_variations[strategy_index]
+                strategy_index = variant_index % len(_MODERATE_VARIATIONS)
+                selected_strategy = _MODERATE_VARIATIONS[strategy_index]
                 variation_index_in_strategy = variant_index % len(selected_strategy)
                 variation = selected_strategy[variation_index_in_strategy]
 
             # 构建变体prompt，确保风格一致性要求在前
             if has_reference:
                 # 有参考图时，在前面重复强调风格一致性
-                style_consistency = "**再次强调** 严格保持与前面画面的艺术风格、角色外观、色彩完全一致"
-                variant_prompt = f"{base_prompt}, {style_consistency}, {variation}"
+                variant_prompt = "".join((base_prompt, ", ", _VARIANT_STYLE_CONSISTENCY, ", ", variation))
             else:
-                variant_prompt = f"{base_prompt}, {variation}"
+                variant_prompt = "".join((base_prompt, ", ", variation))
 
             # 确保prompt长度合理
             if len(variant_prompt) > 400:
@@ -989,17 +1274,13 @@ class ImageGenerator:
         except Exception as e:
             logger.error(f"创建变体prompt失败: {e}")
             # 降级：添加安全的、保持风格一致性的变化
-            if "**强制要求** " in base_prompt:
+            if _FORCE_TAG in base_prompt:
                 # 有参考图时，使用最保守的变化
-                safe_variations = [
-                    "构图微调", "细节优化", "表情调整", "姿态优化"
-                ]
-                safe_variation = safe_variations[variant_index % len(safe_variations)]
+                safe_variation = _SAFE_REFERENCE_VARIATIONS[variant_index % len(_SAFE_REFERENCE_VARIATIONS)]
                 return f"{base_prompt}, **保持风格一致** {safe_variation}"
             else:
                 # 没有参考图时的安全变化
-                safe_variations = ["不同角度", "细节变化", "构图调整", "表情变化"]
-                safe_variation = safe_variations[variant_index % len(safe_variations)]
+                safe_variation = _SAFE_VARIATIONS[variant_index % len(_SAFE_VARIATIONS)]
                 return f"{base_prompt}, {safe_variation}"
 
     async def edit_image_with_prompt(self, image_url: str, edit_prompt: str, project_path: str) -> str:
@@ -1035,14 +1316,10 @@ class ImageGenerator:
 
                 # 下载编辑后的图像
                 try:
-                    from utils.image_utils import download_image_from_url
-                    import time
-
                     filename = f"edited_{int(time.time())}.png"
                     # 使用智能章节编号系统，默认保存到最新章节
-                    chapter_dir = self._get_chapter_dir_name(project_path)
-                    output_dir = f"{project_path}/chapters/{chapter_dir}/images"
-                    output_path = f"{output_dir}/{filename}"
+                    chapter_dir = await asyncio.to_thread(self._get_chapter_dir_name, project_path)
+                    output_path = os.path.join(project_path, "chapters", chapter_dir, "images", filename)
 
                     local_path = await download_image_from_url(edited_url, output_path)
                     logger.info(f"编辑后的图像已下载到本地: {local_path}")
@@ -1070,36 +1347,13 @@ class ImageGenerator:
             提取的对话列表
         """
         try:
-            import re
-            dialogues = []
-
-            # 匹配中文对话格式："..." 或 「...」
-            chinese_quotes_pattern = r'["""](.*?)["""]'
-            chinese_brackets_pattern = r'[「『](.*?)[」』]'
-
-            # 提取引号对话
-            quote_matches = re.findall(chinese_quotes_pattern, text)
-            dialogues.extend([f"\"{dialogue}\"" for dialogue in quote_matches])
-
-            # 提取括号对话
-            bracket_matches = re.findall(chinese_brackets_pattern, text)
-            dialogues.extend([f"「{dialogue}」" for dialogue in bracket_matches])
-
-            # 匹配英文对话格式："..." 或 '...'
-            english_quotes_pattern = r'["\']([^"\']+)["\']'
-            english_matches = re.findall(english_quotes_pattern, text)
-            dialogues.extend([f"\"{dialogue}\"" for dialogue in english_matches])
-
-            # 去重并过滤过短的对话
-            unique_dialogues = []
-            for dialogue in dialogues:
-                if len(dialogue.strip()) > 3 and dialogue not in unique_dialogues:
-                    unique_dialogues.append(dialogue)
+            # 同一分段文本的提取结果会被缓存，重复生成同一分镜时不再重新匹配
+            unique_dialogues = list(_extract_dialogues(text))
 
             if unique_dialogues:
                 logger.info(f"从文本中提取到 {len(unique_dialogues)} 处对话: {unique_dialogues}")
 
-            return unique_dialogues[:3]  # 最多保留3处对话，避免prompt过长
+            return unique_dialogues
 
         except Exception as e:
             logger.error(f"提取对话失败: {e}")
@@ -61,6 +61,10 @@ class Settings:
     VOLCENGINE_ACCESS_KEY: Optional[str] = os.getenv("VOLCENGINE_ACCESS_KEY")
     VOLCENGINE_SECRET_KEY: Optional[str] = os.getenv("VOLCENGINE_SECRET_KEY")
     VOLCENGINE_REGION: str = os.getenv("VOLCENGINE_REGION", "cn-beijing")
+    # 同时进行的火山引擎图像生成调用数上限（整个服务进程共享）
+    VOLCENGINE_MAX_CONCURRENCY: int = int(os.getenv("VOLCENGINE_MAX_CONCURRENCY", "4"))
+    # 封面描述生成的采样温度；设为0时结果确定，封面描述会持久化到磁盘缓存
+    COVER_TEMPERATURE: float = float(os.getenv("COVER_TEMPERATURE", "0.7"))
 
     # 数据库配置（如果需要）
     DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL")
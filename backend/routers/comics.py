@@ -248,17 +248,16 @@ async def create_chapter(
         if not project_path:
             raise HTTPException(status_code=404, detail="项目不存在")
 
-        # 使用智能章节编号系统
-        from agents.image_generator import ImageGenerator
-        image_gen = ImageGenerator()
+        # 使用智能章节编号系统（共享的图像生成器单例，创建章节后清除它缓存的当前章节）
+        from agents.image_generator import image_generator
 
         if request.chapter_number is None:
             # 自动分配下一个章节编号
-            chapter_number = image_gen._get_next_chapter_number(str(project_path))
+            chapter_number = image_generator._get_next_chapter_number(str(project_path))
         else:
             chapter_number = request.chapter_number
 
-        chapter_dir = image_gen._get_chapter_dir_name(str(project_path), chapter_number)
+        chapter_dir = image_generator._get_chapter_dir_name(str(project_path), chapter_number)
 
         # 创建章节目录结构
         chapters_path = project_path / "chapters"
@@ -286,6 +285,9 @@ async def create_chapter(
         with open(chapter_path / "chapter_info.json", "w", encoding="utf-8") as f:
             json.dump(chapter_info, f, ensure_ascii=False, indent=2)
 
+        # 章节结构已变化，清除图像生成器缓存的当前章节
+        image_generator.invalidate_chapter_cache(str(project_path))
+
         logger.info(f"成功创建章节: {chapter_dir} - {chapter_info['title']}")
 
         return {
@@ -309,15 +309,13 @@ async def generate_segment_comics(request: SegmentGenerationRequest):
             "generation_count": request.generation_count
         }
 
-        # 使用ImageGenerator生成组图
-        from agents.image_generator import ImageGenerator
+        # 使用ImageGenerator生成组图（使用共享单例，生成并发上限和各项缓存在请求之间共享）
+        from agents.image_generator import image_generator
         from services.file_system import ProjectFileSystem
 
         fs = ProjectFileSystem()
         project_path = fs._resolve_project_path(request.project_name)
 
-        image_generator = ImageGenerator()
-
         # 获取结构化场景分析数据
         structured_scene_data = None
         try:
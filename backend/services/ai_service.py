@@ -4,11 +4,16 @@ Unified Interface for AI Services
 
 封装对不同AI模型提供商的API调用。
 """
+import asyncio
 import logging
 import os
+import threading
 import time
 import uuid
-from typing import List, Dict, Optional, Any
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Any
+
+from config import settings
+from utils.image_utils import download_image_from_url, decode_base64_to_file
 
 # 移除对volcenginesdkark的顶层导入，改为在方法内部动态导入
 
@@ -155,7 +160,8 @@ class VolcengineService:
         model: str,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
-        response_format: Optional[Dict[str, Any]] = None
+        response_format: Optional[Dict[str, Any]] = None,
+        max_tokens: Optional[int] = None
     ) -> Optional[str]:
         """
         调用聊天补全模型 (如 doubao-lite, doubao-flash)。
@@ -165,6 +171,7 @@ class VolcengineService:
             messages: 消息列表
             temperature: 温度参数
             response_format: 响应格式配置，支持JSON Schema
+            max_tokens: 最大输出token数，为None时使用模型默认值
         """
         if not self.is_available():
             logger.error("火山引擎服务不可用。")
@@ -180,6 +187,10 @@ class VolcengineService:
                 "temperature": temperature,
             }
 
+            # 如果指定了输出长度上限，添加到参数中
+            if max_tokens is not None:
+                completion_params["max_tokens"] = max_tokens
+
             # 如果指定了响应格式，添加到参数中
             if response_format:
                 completion_params["response_format"] = response_format
@@ -194,6 +205,47 @@ class VolcengineService:
             logger.error(f"调用模型 {model} 失败: {e}")
             return None
 
+    def chat_completion_stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        以流式方式调用聊天补全模型，逐段产出生成的文本。
+
+        调用方提前停止迭代时会关闭底层流，服务端随即停止生成。
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            temperature: 温度参数
+            max_tokens: 最大输出token数，为None时使用模型默认值
+        """
+        if not self.is_available():
+            raise RuntimeError("火山引擎服务不可用。")
+
+        completion_params = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+        }
+        if max_tokens is not None:
+            completion_params["max_tokens"] = max_tokens
+
+        logger.info(f"向模型 {model} 发送流式请求...")
+        stream = self.client.chat.completions.create(**completion_params)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+
     def text_to_image(
         self,
         model: str,
@@ -954,7 +1006,8 @@ class AIService:
         temperature: float = 0.7,
         context_id: Optional[str] = None,
         use_json_schema: bool = False,
-        schema_type: Optional[str] = None
+        schema_type: Optional[str] = None,
+        enforce_max_tokens: bool = False
     ) -> str:
         """
         生成文本（用于提示词增强、分析等）。
@@ -962,11 +1015,13 @@ class AIService:
         Args:
             prompt: 提示词
             model_preference: 模型偏好
-            max_tokens: 最大token数
+            max_tokens: 最大token数（只在 enforce_max_tokens 为True时发送给模型）
             temperature: 温度参数
             context_id: 上下文ID，用于多轮对话
             use_json_schema: 是否使用JSON Schema
             schema_type: Schema类型 (text_analysis, character_analysis, script_generation)
+            enforce_max_tokens: 是否把 max_tokens 作为输出长度上限发送给模型；默认不发送，
+                使用模型默认值，避免按旧参数值截断较长的输出
         """
         # 简化模型选择：使用指定的模型或默认模型
         model = model_preference if model_preference in self.TEXT_MODELS else self.TEXT_MODELS[0]
@@ -1004,11 +1059,14 @@ class AIService:
         if self.provider.is_available():
             try:
                 logger.info(f"🔄 使用模型: {model}")
-                result = self.provider.chat_completion(
+                # SDK为同步调用，放到线程中执行，避免阻塞事件循环，使并发请求能够真正重叠
+                result = await asyncio.to_thread(
+                    self.provider.chat_completion,
                     model=model,
                     messages=messages,
                     temperature=temperature,
-                    response_format=response_format
+                    response_format=response_format,
+                    max_tokens=max_tokens if enforce_max_tokens else None
                 )
 
                 if isinstance(result, str) and result.strip():
@@ -1027,6 +1085,82 @@ class AIService:
         else:
             raise RuntimeError("AI文本服务不可用")
 
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        model_preference: str = "deepseek-v3-1-terminus",
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        流式生成文本，边生成边产出文本片段，便于调用方增量解析、提前结束。
+
+        同步SDK的流在线程中读取；调用方停止迭代（break 或 aclose）后，
+        读取线程会在下一个片段到达时关闭底层流，aclose 等待读取线程结束后返回。
+
+        Args:
+            prompt: 提示词
+            model_preference: 模型偏好
+            max_tokens: 最大输出token数，为None时使用模型默认值
+            temperature: 温度参数
+            system_prompt: 系统提示词
+        """
+        if not self.provider.is_available():
+            raise RuntimeError("AI文本服务不可用")
+
+        model = model_preference if model_preference in self.TEXT_MODELS else self.TEXT_MODELS[0]
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.append({"role": "user", "content": prompt})
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop_event = threading.Event()
+        finished = object()
+
+        def produce():
+            pieces = None
+            try:
+                pieces = self.provider.chat_completion_stream(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                for piece in pieces:
+                    if stop_event.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, piece)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                try:
+                    # 显式关闭底层流，服务端随即停止生成
+                    if pieces is not None:
+                        pieces.close()
+                finally:
+                    loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        logger.info(f"🔄 使用模型(流式): {model}")
+        producer = loop.run_in_executor(None, produce)
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    logger.error(f"❌ 模型 {model} 流式调用失败: {item}")
+                    raise RuntimeError(f"AI模型调用失败: {item}")
+                yield item
+        finally:
+            # 通知读取线程停止并等待其关闭底层流，读取线程中的异常在这里记录而不会丢失
+            stop_event.set()
+            try:
+                await producer
+            except Exception as e:
+                logger.warning(f"流式读取线程异常结束: {e}")
+
     async def generate_text_with_context(
         self,
         prompt: str,
@@ -1220,12 +1354,6 @@ class AIService:
         - http/https: 直接下载
         - placeholder://*: 生成1x1透明PNG文件
         """
-        try:
-            from utils.image_utils import download_image_from_url, decode_base64_to_file  # type: ignore
-        except Exception:
-            from utils.image_utils import download_image_from_url, decode_base64_to_file  # type: ignore
-
-        from config import settings
         base_dir = settings.TEMP_DOWNLOADS_DIR  # 改为使用downloads目录，更明确的临时用途
         target_dir = Path(output_dir) if output_dir else base_dir
         target_dir.mkdir(parents=True, exist_ok=True)
@@ -1340,3 +1468,15 @@ class AIService:
             # 最基础的增强
             return original_prompt + "，保持与前一张图片完全相同的角色外观和绘画风格"
 
+
+
+# 共享的AIService实例（底层复用同一个火山引擎客户端及其HTTP连接池）
+_shared_ai_service: Optional[AIService] = None
+
+
+def get_shared_ai_service() -> AIService:
+    """获取共享的AIService实例，避免各Agent重复创建服务对象"""
+    global _shared_ai_service
+    if _shared_ai_service is None:
+        _shared_ai_service = AIService()
+    return _shared_ai_service
@@ -17,7 +17,7 @@ from .file_system import ProjectFileSystem
 from .ai_service import AIService
 from agents.text_analyzer import TextAnalyzer
 from agents.script_generator import ScriptGenerator
-from agents.image_generator import ImageGenerator
+from agents.image_generator import image_generator
 from agents.text_segmenter import TextSegmenter
 from models.comic import TaskStatus, GenerationConfig, ComicPanel
 
@@ -36,7 +36,7 @@ class ComicService:
         self.ai_service = AIService()
         self.text_analyzer = TextAnalyzer()
         self.script_generator = ScriptGenerator()
-        self.image_generator = ImageGenerator()
+        self.image_generator = image_generator
         self.text_segmenter = TextSegmenter()
         self.active_tasks: Dict[str, TaskStatus] = {}
         logger.info("漫画服务初始化完成（包含AI Agent）")
@@ -14,7 +14,7 @@ from fastapi import UploadFile
 from services.file_system import ProjectFileSystem
 from services.comic_service import ComicService
 from services.ai_service import AIService
-from agents.cover_generator import CoverGenerator
+from agents.cover_generator import cover_generator
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +24,7 @@ class CoverService:
 
     def __init__(self):
         self.ai_service = AIService()
-        self.cover_generator = CoverGenerator()
+        self.cover_generator = cover_generator
 
     async def generate_cover(
         self,
@@ -322,6 +322,21 @@ class ProjectFileSystem:
         logger.info(f"处理结果已保存: {result_file}")
         return str(result_file)
 
+    def load_characters(self, project_path: str) -> List[Dict[str, Any]]:
+        """
+        读取角色信息
+
+        Args:
+            project_path: 项目路径
+
+        Returns:
+            角色信息列表，角色文件不存在时返回空列表
+        """
+        characters_file = Path(project_path) / "characters" / "characters.json"
+        if not characters_file.exists():
+            return []
+        return self._load_json(characters_file)
+
     def save_characters(self, project_path: str, characters: List[Dict[str, Any]]):
         """
         保存角色信息
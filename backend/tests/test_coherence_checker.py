@@ -0,0 +1,46 @@
+"""
+连贯性检查器测试
+Coherence Checker Tests
+"""
+
+import asyncio
+
+from agents.coherence_checker import CoherenceChecker
+
+
+class _UnexpectedAIService:
+    """调用即失败的AI服务，用于确认没有发起AI调用"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_text(self, *args, **kwargs):
+        self.calls += 1
+        raise AssertionError("不应调用AI服务")
+
+
+def test_short_text_is_skipped_without_failing_grade():
+    """一行短标题等过短文本不调用AI，返回中性的可接受结果"""
+    ai_service = _UnexpectedAIService()
+    checker = CoherenceChecker(ai_service=ai_service)
+
+    results = asyncio.run(checker.check_coherence("少年推开了学院的大门。", "少年推开学院大门。"))
+
+    assert ai_service.calls == 0
+    assert results['is_acceptable'] is True
+    assert results['total_issues'] == 0
+    assert results['issues'] == []
+    assert results['coherence_score']['overall_score'] >= 0.6
+
+
+def test_empty_text_is_reported_as_unacceptable():
+    """压缩结果为空时不调用AI，报告高严重度问题"""
+    ai_service = _UnexpectedAIService()
+    checker = CoherenceChecker(ai_service=ai_service)
+
+    results = asyncio.run(checker.check_coherence("少年推开了学院的大门。", "   "))
+
+    assert ai_service.calls == 0
+    assert results['is_acceptable'] is False
+    assert results['issues'][0]['issue_type'] == 'empty_text'
+    assert results['issue_summary']['high'] == 1
@@ -349,6 +349,36 @@ class StructuredFormatter(logging.Formatter):
             return f"{record.levelname} - {record.getMessage()}"
 
 
+class DuplicateLogFilter(logging.Filter):
+    """
+    重复日志过滤器：时间窗口内内容相同的日志只输出一次，避免AI服务连续故障时刷屏
+
+    只对 min_level 及以上级别生效，低于该级别的日志（如进度信息）始终输出
+    """
+
+    def __init__(self, window_seconds: float = 1.0, max_entries: int = 256, min_level: int = logging.WARNING):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.min_level = min_level
+        self._last_seen: Dict[tuple, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        last_seen = self._last_seen.get(key)
+        if last_seen is not None and now - last_seen < self.window_seconds:
+            return False
+
+        if len(self._last_seen) >= self.max_entries:
+            self._last_seen.clear()
+        self._last_seen[key] = now
+        return True
+
+
 # 全局日志管理器
 class LogManager:
     """日志管理器"""
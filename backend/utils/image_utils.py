@@ -8,6 +8,7 @@ Image Processing Utility Functions
 import os
 import base64
 import mimetypes
+import aiofiles
 import httpx
 import hashlib
 import time
@@ -17,6 +18,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# 下载图像时每次写入磁盘的块大小
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 def encode_file_to_base64(file_path: str) -> str:
     """
@@ -216,16 +220,25 @@ async def download_image_from_url(
         # 确保输出目录存在
         Path(save_path).parent.mkdir(parents=True, exist_ok=True)
 
-        # 下载文件
+        # 流式下载并分块异步写入文件，避免整张图片驻留内存以及阻塞事件循环
+        file_size = 0
         async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-            response = await client.get(image_url)
-            response.raise_for_status()
-
-            # 保存文件
-            with open(save_path, "wb") as f:
-                f.write(response.content)
+            async with client.stream("GET", image_url) as response:
+                response.raise_for_status()
+
+                try:
+                    async with aiofiles.open(save_path, "wb") as f:
+                        async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                            await f.write(chunk)
+                            file_size += len(chunk)
+                except BaseException:
+                    # 下载中断时删除写了一半的文件
+                    try:
+                        os.remove(save_path)
+                    except OSError:
+                        pass
+                    raise
 
-        file_size = os.path.getsize(save_path)
         logger.info(f"图像下载成功: {image_url} -> {save_path}, 大小: {file_size} 字节")
         return save_path
 
@@ -277,7 +290,6 @@ def generate_unique_filename(original_path: str, suffix: str = "") -> str:
     path = Path(original_path)
 
     # 生成时间戳和哈希
-    import time
     timestamp = int(time.time())
     hash_obj = hashlib.md5(f"{original_path}{timestamp}".encode())
     hash_suffix = hash_obj.hexdigest()[:8]
@@ -40,6 +40,7 @@ def check_requirements():
         ("pydantic", "pydantic"),
         ("httpx", "httpx"),
         ("aiofiles", "aiofiles"),
+        ("orjson", "orjson"),
         ("pillow", "PIL"),
         ("langgraph", "langgraph"),
         ("openai", "openai"),